@@ -0,0 +1,172 @@
+"""Admission control for model invocations.
+
+Bounds how many generations run against the model endpoint at once, globally
+and per user. Requests over the limit wait in a priority queue (action resumes
+ahead of new messages) and can report their queue position while waiting.
+"""
+import asyncio
+import bisect
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+
+PRIORITY_ACTION = 0
+PRIORITY_MESSAGE = 1
+
+# How often a waiting request re-checks its queue position
+POSITION_POLL_SECONDS = 0.5
+
+
+class _Waiter:
+    __slots__ = ("priority", "order", "user_id", "future")
+
+    def __init__(self, priority: int, order: int, user_id: str, future: asyncio.Future):
+        self.priority = priority
+        self.order = order
+        self.user_id = user_id
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.order) < (other.priority, other.order)
+
+
+class QueueMetrics:
+    """Running counters for time spent waiting for admission."""
+
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0
+        self.abandoned = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float, queued: bool) -> None:
+        self.admitted += 1
+        if queued:
+            self.queued += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self) -> Dict[str, float]:
+        avg = self.total_wait / self.admitted if self.admitted else 0.0
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "abandoned": self.abandoned,
+            "avg_wait_ms": round(avg * 1000, 2),
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 32, max_per_user: int = 2):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.active = 0
+        self._active_by_user: Dict[str, int] = {}
+        self._waiting: List[_Waiter] = []
+        self._order = itertools.count()
+        self.metrics = QueueMetrics()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            max_per_user=int(os.getenv("LLM_MAX_PER_USER", "2")),
+        )
+
+    def _has_capacity(self, user_id: str) -> bool:
+        return (
+            self.active < self.max_concurrency
+            and self._active_by_user.get(user_id, 0) < self.max_per_user
+        )
+
+    def _grant(self, user_id: str) -> None:
+        self.active += 1
+        self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+
+    def _release(self, user_id: str) -> None:
+        self.active -= 1
+        left = self._active_by_user.get(user_id, 1) - 1
+        if left > 0:
+            self._active_by_user[user_id] = left
+        else:
+            self._active_by_user.pop(user_id, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit waiters in priority order, skipping users at their limit."""
+        i = 0
+        while i < len(self._waiting) and self.active < self.max_concurrency:
+            w = self._waiting[i]
+            if w.future.done() or not self._has_capacity(w.user_id):
+                i += 1
+                continue
+            self._waiting.pop(i)
+            self._grant(w.user_id)
+            w.future.set_result(True)
+
+    def position(self, waiter: _Waiter) -> int:
+        try:
+            return self._waiting.index(waiter) + 1
+        except ValueError:
+            return 0
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: str,
+        priority: int = PRIORITY_MESSAGE,
+        on_position: Optional[Callable[[int], Awaitable[None]]] = None,
+    ):
+        """Hold one model-invocation slot for the duration of the block.
+
+        `on_position` is awaited with the 1-based queue position whenever it
+        changes while waiting.
+        """
+        started = time.monotonic()
+        queued = False
+
+        if not self._waiting and self._has_capacity(user_id):
+            self._grant(user_id)
+        else:
+            waiter = _Waiter(priority, next(self._order), user_id, asyncio.get_running_loop().create_future())
+            bisect.insort(self._waiting, waiter)
+            self._dispatch()
+            queued = not waiter.future.done()
+            last_pos = 0
+            try:
+                while not waiter.future.done():
+                    pos = self.position(waiter)
+                    if pos != last_pos and on_position is not None:
+                        last_pos = pos
+                        await on_position(pos)
+                    if waiter.future.done():
+                        break
+                    await asyncio.wait({waiter.future}, timeout=POSITION_POLL_SECONDS)
+            except BaseException:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release(user_id)  # granted right as we were cancelled
+                else:
+                    waiter.future.cancel()
+                    if waiter in self._waiting:
+                        self._waiting.remove(waiter)
+                    self.metrics.abandoned += 1
+                raise
+
+        self.metrics.record(time.monotonic() - started, queued)
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "active": self.active,
+            "waiting": len(self._waiting),
+            "max_concurrency": self.max_concurrency,
+            "max_per_user": self.max_per_user,
+            **self.metrics.snapshot(),
+        }
@@ -0,0 +1,206 @@
+"""Cold tier for the event buffer: compressed per-conversation event logs.
+
+When a conversation completes, or before its Redis key would expire, the
+buffer archives the events added since the previous pass: they are joined
+(one JSON envelope per line), compressed (zstd when `zstandard` is
+installed, gzip otherwise) and stored as one chunk row in a local SQLite
+file. Earlier chunks are never rewritten, so each pass costs only the new
+events. Passes run in the I/O pool, one at a time per conversation
+(`schedule`), so the event loop never compresses or commits.
+`EventBuffer.replay` falls back to this archive for anything no longer in
+Redis, so clients can resume for hours without keeping hours of events in
+Redis.
+"""
+import asyncio
+import gzip
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from events import Event
+from services.utils.executors import run_io
+from services.utils.paths import backend_path
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+DEFAULT_PATH = backend_path(os.getenv("EVENT_ARCHIVE_PATH", "event_archive.db"))
+DEFAULT_RETENTION_SECONDS = int(os.getenv("EVENT_ARCHIVE_RETENTION_SECONDS", str(6 * 3600)))
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(blob: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+
+class EventArchive:
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        retention_seconds: int = DEFAULT_RETENTION_SECONDS,
+        codec: Optional[str] = None,
+    ):
+        self.path = path
+        self.retention = retention_seconds
+        self.codec = codec or os.getenv("EVENT_ARCHIVE_CODEC") or ("zstd" if zstandard else "gzip")
+        if self.codec == "zstd" and zstandard is None:
+            self.codec = "gzip"
+
+        # one connection shared by the loop and worker threads, serialized by a lock
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS archived_chunks ("
+            " conversation_id TEXT NOT NULL,"
+            " first_sequence INTEGER NOT NULL,"
+            " last_sequence INTEGER NOT NULL,"
+            " codec TEXT NOT NULL,"
+            " blob BLOB NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (conversation_id, first_sequence))"
+        )
+        self._migrate()
+        self._lock = threading.Lock()
+        # conversation_id -> the archive pass running or queued last for it
+        self._passes: Dict[str, asyncio.Task] = {}
+        self._pruning: Optional[asyncio.Task] = None
+
+    def _migrate(self) -> None:
+        # earlier versions kept one blob per conversation; it becomes its first chunk
+        if self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_events'"
+        ).fetchone() is None:
+            return
+        self._db.execute("BEGIN")
+        self._db.execute(
+            "INSERT OR IGNORE INTO archived_chunks"
+            " SELECT conversation_id, 0, last_sequence, codec, blob, updated_at FROM archived_events"
+        )
+        self._db.execute("DROP TABLE archived_events")
+        self._db.execute("COMMIT")
+
+    def _last_sequence(self, conversation_id: str) -> int:
+        row = self._db.execute(
+            "SELECT MAX(last_sequence) FROM archived_chunks WHERE conversation_id = ?",
+            (conversation_id,),
+        ).fetchone()
+        return row[0] or 0
+
+    def last_sequence(self, conversation_id: str) -> int:
+        with self._lock:
+            return self._last_sequence(conversation_id)
+
+    def store(self, conversation_id: str, events: List[tuple[int, str]]) -> int:
+        """
+        Append `(sequence, raw_json)` events to the archived log as a new chunk.
+
+        Events already archived are skipped, so storing the same events
+        twice is harmless. Blocking; run it in the I/O pool. Returns the
+        number of events added.
+        """
+        with self._lock:
+            archived_upto = self._last_sequence(conversation_id)
+            new = sorted({seq: raw for seq, raw in events if seq > archived_upto}.items())
+            if not new:
+                return 0
+
+            blob = _compress("\n".join(raw for _, raw in new).encode("utf-8"), self.codec)
+            self._db.execute(
+                "INSERT OR REPLACE INTO archived_chunks VALUES (?, ?, ?, ?, ?, ?)",
+                (conversation_id, new[0][0], new[-1][0], self.codec, blob, time.time()),
+            )
+            return len(new)
+
+    def load(self, conversation_id: str, after: int = 0) -> List[str]:
+        """Archived raw envelopes of a conversation, in sequence order.
+
+        Only chunks holding events after sequence `after` are read.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT codec, blob FROM archived_chunks"
+                " WHERE conversation_id = ? AND last_sequence > ? ORDER BY first_sequence",
+                (conversation_id, after),
+            ).fetchall()
+        lines: List[str] = []
+        for codec, blob in rows:
+            lines.extend(_decompress(blob, codec).decode("utf-8").split("\n"))
+        return lines
+
+    def prune(self) -> int:
+        """Drop conversations not archived to within the retention window."""
+        with self._lock:
+            cur = self._db.execute(
+                "DELETE FROM archived_chunks WHERE conversation_id IN ("
+                " SELECT conversation_id FROM archived_chunks"
+                " GROUP BY conversation_id HAVING MAX(updated_at) < ?)",
+                (time.time() - self.retention,),
+            )
+            return cur.rowcount
+
+    # -------- background passes --------
+
+    def prune_later(self) -> None:
+        """`prune` in the I/O pool, unless the previous one is still running."""
+        if self._pruning is None or self._pruning.done():
+            self._pruning = asyncio.create_task(self._prune())
+
+    async def _prune(self) -> None:
+        try:
+            await run_io(self.prune)
+        except Exception as e:
+            print(f"[ARCHIVE] pruning failed: {e}")
+
+    def schedule(self, conversation_id: str, archive_pass: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Run `archive_pass` in the background once any earlier pass of the
+        same conversation has finished, so its chunks are written in
+        sequence order. Call it on the event loop.
+        """
+        task = asyncio.create_task(self._run_pass(conversation_id, self._passes.get(conversation_id), archive_pass))
+        self._passes[conversation_id] = task
+        task.add_done_callback(lambda t: self._pass_done(conversation_id, t))
+
+    async def _run_pass(self, conversation_id: str, previous: Optional[asyncio.Task], archive_pass) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await archive_pass()
+        except Exception as e:
+            print(f"[ARCHIVE] archiving {conversation_id} failed: {e}")
+
+    def _pass_done(self, conversation_id: str, task: asyncio.Task) -> None:
+        if self._passes.get(conversation_id) is task:
+            del self._passes[conversation_id]
+
+    async def join(self) -> None:
+        """Wait for the archive passes scheduled so far (used on drain)."""
+        if self._passes:
+            await asyncio.wait(list(self._passes.values()))
+
+    def backfill(self, conversation_id: str, last_sequence: int, hot: List[Event]) -> List[Event]:
+        """
+        Prepend archived events missing from `hot` (events after
+        `last_sequence` that the hot tier no longer holds).
+        """
+        if hot and hot[0].sequence == last_sequence + 1:
+            return hot
+
+        hot_from = hot[0].sequence if hot else None
+        cold: List[Event] = []
+        for raw in self.load(conversation_id, last_sequence):
+            ev = Event.from_json(raw)
+            if ev.sequence > last_sequence and (hot_from is None or ev.sequence < hot_from):
+                cold.append(ev)
+        return cold + hot
@@ -0,0 +1,67 @@
+"""Memory-per-conversation benchmark.
+
+Creates N idle-but-resumable conversations the way the orchestrator does
+(user context attached, a few events emitted) and reports the retained
+memory per conversation and per in-flight Event, measured with tracemalloc.
+No Redis or model is needed: the event buffer is replaced by a null sink.
+
+    python bench_memory.py --conversations 50000 --events 4
+"""
+import argparse
+import asyncio
+import gc
+import tracemalloc
+
+from events import new_event
+from orchestrator import Orchestrator
+
+
+class _NullBuffer:
+    def append(self, conversation_id, sequence, event):
+        pass
+
+    def replay_events(self, conversation_id, last_sequence):
+        return []
+
+
+async def bench(conversations: int, events: int) -> None:
+    orch = Orchestrator(_NullBuffer())
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    for i in range(conversations):
+        conv_id = f"conv-{i:08d}"
+        conv = orch._ensure_conv(conv_id)
+        conv.user_id = f"user-{i % 1000:04d}"
+        for _ in range(events):
+            await orch._emit(conv, "status", {"status": "analyzing"})
+
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    conv_bytes = sum(s.size_diff for s in after.compare_to(before, "filename"))
+
+    # events as they sit in a connection queue, serialized once
+    held = []
+    snap = tracemalloc.take_snapshot()
+    for i in range(10000):
+        ev = new_event("token", "conv-00000001", i, {"text": "hello world "}, "user-0001")
+        ev.to_json()
+        held.append(ev)
+    gc.collect()
+    event_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(snap, "filename"))
+    tracemalloc.stop()
+
+    print(f"conversations:          {conversations}")
+    print(f"events per conversation: {events}")
+    print(f"bytes per conversation:  {conv_bytes / conversations:.0f}")
+    print(f"bytes per queued event:  {event_bytes / len(held):.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=50000)
+    parser.add_argument("--events", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(bench(args.conversations, args.events))
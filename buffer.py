@@ -4,33 +4,234 @@ Redis-backed event buffer for conversation replay.
 This buffer stores full event envelopes in Redis and supports
 replay by sequence number. Designed to be a drop-in replacement
 for the in-memory EventBuffer used by the orchestrator.
+
+Conversations are spread over one or more Redis nodes (`REDIS_URLS`) with
+a consistent-hash ring on `conversation_id` (plain, independent nodes:
+Redis Cluster is not supported, its MOVED/ASK redirects are not followed).
+Each node has its own connection pool. When a node stops answering, its
+conversations are kept in a bounded in-memory ring buffer until the node
+is healthy again, so streaming degrades instead of failing. A down node is
+only used again after a ping in the I/O pool succeeds, so an unresponsive
+host never stalls the event loop for a socket timeout.
+
+Redis is the hot tier only. When a conversation completes (a `done` event)
+or has been idle for most of the TTL, the events added since the last pass
+are copied to the compressed archive (see archive.py) in the background,
+and replay falls back to the archive for events that have already expired
+from Redis.
 """
+import asyncio
+import bisect
+import hashlib
 import os
 import json
-from typing import Dict, List
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
 import redis
 
+from archive import DEFAULT_PATH as ARCHIVE_PATH, EventArchive
+from events import Event
+from services.utils.executors import run_io
+
+# Archive conversations idle for this long (keep below the Redis TTL)
+ARCHIVE_IDLE_SECONDS = int(os.getenv("EVENT_ARCHIVE_IDLE_SECONDS", "240"))
+
+REDIS_VNODES = int(os.getenv("REDIS_VNODES", "160"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1.0"))
+# How long a failed node is skipped before it is probed again
+REDIS_RETRY_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS", "5"))
+# Events kept per conversation while its node is down
+DEGRADED_MAX_EVENTS = int(os.getenv("REDIS_DEGRADED_MAX_EVENTS", "1000"))
+
+_SHARD_ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+
+def _redis_urls() -> List[str]:
+    urls = os.getenv("REDIS_URLS") or os.getenv("REDIS_URL", "redis://localhost:6379")
+    return [u.strip() for u in urls.split(",") if u.strip()]
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes."""
+
+    def __init__(self, nodes: List[str], vnodes: int = REDIS_VNODES):
+        points = sorted(
+            (self._hash(f"{node}#{i}"), idx)
+            for idx, node in enumerate(nodes)
+            for i in range(vnodes)
+        )
+        self._points = [p for p, _ in points]
+        self._owners = [idx for _, idx in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key: str) -> int:
+        """Index of the node owning `key`."""
+        i = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[i]
+
+
+class RedisShard:
+    __slots__ = ("url", "redis", "down", "retry_at", "failures", "_probe")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.redis = redis.Redis.from_url(
+            url,
+            decode_responses=True,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+        self.down = False
+        self.retry_at = 0.0
+        self.failures = 0
+        self._probe: Optional[asyncio.Task] = None
+
+    def healthy(self) -> bool:
+        return not self.down
+
+    def mark_down(self, error: Exception) -> None:
+        if not self.down:
+            print(f"[BUFFER] redis node {self.url} unavailable, degrading: {error}")
+        self.down = True
+        self.failures += 1
+        self.retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+
+    def probe_later(self) -> None:
+        """
+        Ping a down node in the I/O pool once the retry interval has passed;
+        it takes traffic again only after a ping succeeds. Call on the loop.
+        """
+        if not self.down or time.monotonic() < self.retry_at:
+            return
+        if self._probe is None or self._probe.done():
+            self._probe = asyncio.create_task(self._ping())
+
+    async def _ping(self) -> None:
+        try:
+            await run_io(self.redis.ping)
+        except Exception as e:
+            self.mark_down(e)
+            return
+        self.down = False
+        print(f"[BUFFER] redis node {self.url} is back")
+
 
 class EventBuffer:
     def __init__(
         self,
         redis_url: str | None = None,
         ttl_seconds: int = 300,
+        archive: Optional[EventArchive] = None,
     ):
-        redis_url = redis_url or os.getenv(
-            "REDIS_URL", "redis://localhost:6379"
-        )
+        urls = [redis_url] if redis_url else _redis_urls()
 
-        self.redis = redis.Redis.from_url(
-            redis_url,
-            decode_responses=True,
-        )
+        self.shards = [RedisShard(url) for url in urls]
+        self.ring = HashRing(urls)
         self.ttl = ttl_seconds
+        # conversation_id -> raw events written while its node was down
+        self._degraded: Dict[str, Deque[str]] = {}
+        self._degraded_at: Dict[str, float] = {}
+
+        if archive is None and ARCHIVE_PATH:
+            archive = EventArchive()
+        self.archive = archive
+        self.archive_idle = min(ARCHIVE_IDLE_SECONDS, ttl_seconds)
+        # conversation_id -> monotonic time of the last append not yet archived
+        self._unarchived: Dict[str, float] = {}
+
+    def warm_up(self, connections: int = 4) -> int:
+        """
+        Open pooled Redis connections ahead of the first conversation.
+
+        Blocking; call it from a worker thread during startup.
+        """
+        opened = 0
+        for shard in self.shards:
+            pool = shard.redis.connection_pool
+            conns = [pool.get_connection("PING") for _ in range(connections)]
+            try:
+                for conn in conns:
+                    conn.send_command("PING")
+                    conn.read_response()
+            finally:
+                for conn in conns:
+                    pool.release(conn)
+            opened += len(conns)
+        return opened
 
     def _key(self, conversation_id: str) -> str:
-        return f"conv:{conversation_id}"
+        return f"conv:{{{conversation_id}}}"
+
+    def _shard(self, conversation_id: str) -> RedisShard:
+        return self.shards[self.ring.node_for(conversation_id)]
 
-    def append(self, conversation_id: str, sequence: int, event: Dict) -> None:
+    def _degrade(self, conversation_id: str, raw: str) -> None:
+        q = self._degraded.get(conversation_id)
+        if q is None:
+            q = self._degraded[conversation_id] = deque(maxlen=DEGRADED_MAX_EVENTS)
+        q.append(raw)
+        self._degraded_at[conversation_id] = time.monotonic()
+
+    def _lrange(self, conversation_id: str, start: int = 0, held: Optional[List[str]] = None) -> List[str]:
+        """Hot events of a conversation: Redis plus anything held while degraded.
+
+        `held` is a copy of the degraded events taken by the caller when this
+        runs off the event loop.
+        """
+        shard = self._shard(conversation_id)
+        raw_events: List[str] = []
+        if shard.healthy():
+            try:
+                raw_events = shard.redis.lrange(self._key(conversation_id), start, -1)
+            except _SHARD_ERRORS as e:
+                shard.mark_down(e)
+        if held is None:
+            held = self._degraded.get(conversation_id)
+        if held:
+            raw_events = raw_events + list(held)
+        return raw_events
+
+    def _events_after(self, conversation_id: str, last_sequence: int, held: Optional[List[str]] = None) -> List[Event]:
+        """Hot events with sequence > `last_sequence`, decoding only those.
+
+        A conversation's list holds consecutive sequence numbers, so its first
+        element tells where `last_sequence` sits and its last one whether
+        anything newer exists (one round trip for both). When the guessed
+        position does not land right after `last_sequence` (a gap left by a
+        degraded period) the whole list is read.
+        """
+        start = 0
+        shard = self._shard(conversation_id)
+        if last_sequence > 0 and shard.healthy():
+            key = self._key(conversation_id)
+            try:
+                pipe = shard.redis.pipeline(transaction=False)
+                pipe.lindex(key, 0)
+                pipe.lindex(key, -1)
+                first, newest = pipe.execute()
+            except _SHARD_ERRORS as e:
+                shard.mark_down(e)
+            else:
+                if newest is not None and Event.from_json(newest).sequence <= last_sequence:
+                    # caught up: only events held for a down node can be newer
+                    if held is None:
+                        held = self._degraded.get(conversation_id) or ()
+                    return [ev for ev in map(Event.from_json, held) if ev.sequence > last_sequence]
+                if first is not None:
+                    start = max(0, last_sequence + 1 - Event.from_json(first).sequence)
+
+        events = [Event.from_json(raw) for raw in self._lrange(conversation_id, start, held=held)]
+        if start and (not events or events[0].sequence != last_sequence + 1):
+            events = [Event.from_json(raw) for raw in self._lrange(conversation_id, held=held)]
+        return [ev for ev in events if ev.sequence > last_sequence]
+
+    def append(self, conversation_id: str, sequence: int, event: Event | Dict) -> None:
         """
         Append an event to the conversation buffer.
 
@@ -38,38 +239,195 @@ class EventBuffer:
         TTL is refreshed on every append.
         """
         key = self._key(conversation_id)
+        shard = self._shard(conversation_id)
+
+        # Store full event envelope (an Event reuses its cached JSON)
+        if isinstance(event, Event):
+            raw, event_type = event.to_json(), event.type
+        else:
+            raw, event_type = json.dumps(event), event.get("type")
 
-        # Store full event envelope
-        self.redis.rpush(key, json.dumps(event))
+        if not shard.healthy():
+            self._degrade(conversation_id, raw)
+            shard.probe_later()
+        else:
+            held = self._degraded.get(conversation_id)
+            try:
+                # Node is back: move events held in memory ahead of the new one
+                pipe = shard.redis.pipeline(transaction=False)
+                pipe.rpush(key, *(list(held) if held else []), raw)
+                # Refresh TTL so active conversations stay alive
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+                if held:
+                    del self._degraded[conversation_id]
+                    self._degraded_at.pop(conversation_id, None)
+            except _SHARD_ERRORS as e:
+                shard.mark_down(e)
+                self._degrade(conversation_id, raw)
 
-        # Refresh TTL so active conversations stay alive
-        self.redis.expire(key, self.ttl)
+        if self.archive is None:
+            return
+        if event_type == "done":
+            self.archive_later(conversation_id)
+        else:
+            self._unarchived[conversation_id] = time.monotonic()
+
+    def archive_conversation(self, conversation_id: str, held: Optional[List[str]] = None) -> int:
+        """
+        Copy the conversation's events not yet archived into the cold archive.
+
+        Blocking (Redis read, compression, SQLite commit); the event loop
+        goes through `archive_later`. Returns the number of newly archived
+        events.
+        """
+        if self.archive is None:
+            return 0
+        events = self._events_after(conversation_id, self.archive.last_sequence(conversation_id), held)
+        return self.archive.store(conversation_id, [(ev.sequence, ev.to_json()) for ev in events])
+
+    def archive_later(self, conversation_id: str) -> None:
+        """Run `archive_conversation` in the I/O pool, after any earlier pass of the conversation."""
+        self._unarchived.pop(conversation_id, None)
+        if self.archive is None:
+            return
+
+        async def _pass():
+            held = list(self._degraded.get(conversation_id) or ())
+            await run_io(self.archive_conversation, conversation_id, held)
+
+        self.archive.schedule(conversation_id, _pass)
 
     def replay(self, conversation_id: str, last_sequence: int) -> List[Dict]:
         """
         Replay buffered events with sequence > last_sequence.
         Used by the 'resume' client event.
         """
-        key = self._key(conversation_id)
+        return [ev.to_dict() for ev in self.replay_events(conversation_id, last_sequence)]
 
-        raw_events = self.redis.lrange(key, 0, -1)
-        if not raw_events:
-            return []
+    def replay_events(self, conversation_id: str, last_sequence: int, held: Optional[List[str]] = None) -> List[Event]:
+        """
+        Like `replay`, but returns `Event` records that keep the stored JSON,
+        so sending them again does not re-serialize.
 
-        events: List[Dict] = []
-        for raw in raw_events:
-            ev = json.loads(raw)
-            if ev.get("sequence", 0) > last_sequence:
-                events.append(ev)
+        Events that already expired from Redis are read from the archive.
+        """
+        events = self._events_after(conversation_id, last_sequence, held)
+        if self.archive is None:
+            return events
+        return self.archive.backfill(conversation_id, last_sequence, events)
+
+    async def load_replay(self, conversation_id: str, last_sequence: int) -> List[Event]:
+        """`replay_events` in the I/O pool: Redis round trip, archive read and decode off the loop."""
+        held = list(self._degraded.get(conversation_id) or ())
+        return await run_io(self.replay_events, conversation_id, last_sequence, held)
+
+    def last_sequence(self, conversation_id: str, held: Optional[List[str]] = None) -> int:
+        """Highest sequence kept for the conversation in Redis, degraded memory or the archive."""
+        last = 0
+        shard = self._shard(conversation_id)
+        if shard.healthy():
+            try:
+                raw = shard.redis.lindex(self._key(conversation_id), -1)
+            except _SHARD_ERRORS as e:
+                shard.mark_down(e)
+            else:
+                if raw is not None:
+                    last = Event.from_json(raw).sequence
+        if held:
+            last = max(last, Event.from_json(held[-1]).sequence)
+        if self.archive is not None:
+            last = max(last, self.archive.last_sequence(conversation_id))
+        return last
+
+    async def load_last_sequence(self, conversation_id: str) -> int:
+        """`last_sequence` in the I/O pool."""
+        held = list(self._degraded.get(conversation_id) or ())
+        return await run_io(self.last_sequence, conversation_id, held)
+
+    def replay_tail(self, conversation_id: str, last_sequence: int, count: int) -> List[Event]:
+        """
+        Events after `last_sequence` among the newest `count`: the ones
+        emitted while a `load_replay` was in flight. Small, so read inline.
+        """
+        raw_events = self._lrange(conversation_id, start=-count)[-count:]
+        events = [Event.from_json(raw) for raw in raw_events]
+        return [ev for ev in events if ev.sequence > last_sequence]
+
+    def flush(self) -> int:
+        """
+        Make everything buffered survive this process (called on shutdown).
+
+        Events held in memory for a failed node are pushed to it if it is
+        reachable again, otherwise archived. Returns the number of
+        conversations still held only in memory (lost on exit).
+        """
+        for conversation_id in list(self._degraded):
+            shard = self._shard(conversation_id)
+            held = self._degraded[conversation_id]
+            try:
+                key = self._key(conversation_id)
+                pipe = shard.redis.pipeline(transaction=False)
+                pipe.rpush(key, *held)
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+                del self._degraded[conversation_id]
+                self._degraded_at.pop(conversation_id, None)
+            except _SHARD_ERRORS as e:
+                shard.mark_down(e)
+                if self.archive is not None:
+                    self.archive_conversation(conversation_id)
+                    del self._degraded[conversation_id]
+                    self._degraded_at.pop(conversation_id, None)
+        return len(self._degraded)
+
+    def snapshot(self) -> Dict:
+        """Per-node health, for /metrics."""
+        return {
+            "backend": "redis",
+            "shards": [
+                {"url": s.url.rsplit("@", 1)[-1], "healthy": s.healthy(), "failures": s.failures}
+                for s in self.shards
+            ],
+            "degraded_conversations": len(self._degraded),
+        }
 
-        return events
-    
     def cleanup(self) -> None:
         """
-        No-op cleanup for Redis buffer.
+        Archive conversations that have gone idle before Redis expires them,
+        and prune archives past their retention window (both in the
+        background).
 
-        Redis uses TTL to expire keys automatically,
-        so no periodic cleanup is required.
+        Expiry of the hot tier itself is left to the Redis TTL. Events held
+        in memory for a node that never came back expire with the same TTL.
         """
-        return
+        # nodes down with nothing appended to them are probed from here
+        for shard in self.shards:
+            shard.probe_later()
+
+        now = time.monotonic()
+        for conversation_id, last_append in list(self._unarchived.items()):
+            if last_append <= now - self.archive_idle:
+                self.archive_later(conversation_id)
+
+        for conversation_id, held_at in list(self._degraded_at.items()):
+            if held_at <= now - self.ttl:
+                self._degraded.pop(conversation_id, None)
+                del self._degraded_at[conversation_id]
+
+        if self.archive is not None:
+            self.archive.prune_later()
+
+
+def create_buffer(backend: str | None = None):
+    """
+    Build the event buffer selected by `EVENT_BUFFER_BACKEND`:
+    "redis" (default, shared across workers) or "memory" (single node).
+    """
+    backend = backend or os.getenv("EVENT_BUFFER_BACKEND", "redis")
+    ttl_seconds = int(os.getenv("EVENT_BUFFER_TTL_SECONDS", "300"))
+    if backend == "memory":
+        from memory_buffer import MemoryEventBuffer
 
+        return MemoryEventBuffer(ttl_seconds=ttl_seconds)
+    return EventBuffer(ttl_seconds=ttl_seconds)
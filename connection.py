@@ -0,0 +1,216 @@
+"""Per-socket outbound connection with conversation multiplexing.
+
+One WebSocket can watch many conversations. Each subscribed conversation gets
+its own outbound channel (queue + optional credit window) and a single writer
+task drains the channels round-robin, so one chatty conversation cannot starve
+the others sharing the socket.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
+
+from events import Event
+from services.utils.tracing import tracer
+
+# Events queued per conversation before the channel is marked as lagged.
+DEFAULT_MAX_QUEUE = int(os.getenv("WS_CHANNEL_MAX_QUEUE", "1000"))
+
+
+class ConversationChannel:
+    """Outbound lane of a single conversation on a single connection."""
+
+    __slots__ = ("conversation_id", "queue", "credits", "last_sequence", "lagged", "holds")
+
+    def __init__(self, conversation_id: str, credits: Optional[int] = None):
+        self.conversation_id = conversation_id
+        self.queue: Deque[Event] = deque()
+        # None means no flow control (send as fast as the socket allows)
+        self.credits: Optional[int] = credits
+        # highest sequence already queued for this connection
+        self.last_sequence = 0
+        self.lagged = False
+        # replays loading for this channel; live events are not queued meanwhile
+        self.holds = 0
+
+    def sendable(self) -> bool:
+        return bool(self.queue) and (self.credits is None or self.credits > 0)
+
+
+class ClientConnection:
+    """Wraps a WebSocket and multiplexes conversation events onto it.
+
+    Events are never written to the socket directly by the orchestrator: they
+    are queued on the conversation's channel and the writer task sends them,
+    one event per conversation per round. Connection-level messages (errors
+    that do not belong to a conversation) go through a control lane that is
+    always served first.
+    """
+
+    def __init__(self, websocket, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.channels: Dict[str, ConversationChannel] = {}
+        self._control: Deque[Dict[str, Any]] = deque()
+        self._ready: Deque[str] = deque()
+        self._ready_set: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+
+    # -------- lifecycle --------
+
+    def start(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._writer_loop())
+
+    async def close(self) -> None:
+        self.closed = True
+        self._wakeup.set()
+        if self._writer and not self._writer.done():
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+        self.channels.clear()
+        self._ready.clear()
+        self._ready_set.clear()
+
+    # -------- subscriptions / flow control --------
+
+    def subscribe(self, conversation_id: str, credits: Optional[int] = None) -> ConversationChannel:
+        ch = self.channels.get(conversation_id)
+        if ch is None:
+            ch = ConversationChannel(conversation_id, credits)
+            self.channels[conversation_id] = ch
+        elif credits is not None:
+            ch.credits = credits
+            self._mark_ready(ch)
+        return ch
+
+    def unsubscribe(self, conversation_id: str) -> None:
+        self.channels.pop(conversation_id, None)
+        self._ready_set.discard(conversation_id)
+
+    def is_subscribed(self, conversation_id: str) -> bool:
+        return conversation_id in self.channels
+
+    def grant(self, conversation_id: str, credits: int) -> None:
+        """Add send credits for a conversation (switches it to credit mode)."""
+        ch = self.channels.get(conversation_id)
+        if ch is None or credits <= 0:
+            return
+        ch.credits = (ch.credits or 0) + credits
+        self._mark_ready(ch)
+
+    def hold(self, conversation_id: str) -> ConversationChannel:
+        """
+        Stop queueing live events of a conversation while a replay loads.
+
+        They are dropped rather than sent ahead of the replay; the replay
+        picks them up from the buffer. Pair with `release`.
+        """
+        ch = self.subscribe(conversation_id)
+        ch.holds += 1
+        return ch
+
+    def release(self, ch: ConversationChannel) -> None:
+        ch.holds -= 1
+
+    def rewind(self, conversation_id: str, last_sequence: int) -> ConversationChannel:
+        """Drop queued events so a replay from `last_sequence` can be enqueued."""
+        ch = self.subscribe(conversation_id)
+        ch.queue.clear()
+        ch.last_sequence = last_sequence
+        ch.lagged = False
+        return ch
+
+    # -------- enqueue --------
+
+    def send(self, event: Event) -> bool:
+        """Queue a conversation event. Returns False if it was not queued."""
+        if self.closed:
+            return False
+        ch = self.channels.get(event.conversation_id)
+        if ch is None or ch.lagged or ch.holds:
+            return False
+
+        seq = event.sequence or 0
+        if seq and seq <= ch.last_sequence:
+            return False  # already queued (replay/live overlap)
+
+        if len(ch.queue) >= self.max_queue:
+            # client is not keeping up: stop queueing and tell it to resume
+            ch.queue.clear()
+            ch.lagged = True
+            self.send_control({
+                "type": "status",
+                "conversation_id": ch.conversation_id,
+                "payload": {"status": "lagged", "last_sequence": ch.last_sequence},
+            })
+            return False
+
+        ch.queue.append(event)
+        if seq:
+            ch.last_sequence = seq
+        self._mark_ready(ch)
+        return True
+
+    def send_control(self, payload: Dict[str, Any]) -> None:
+        if self.closed:
+            return
+        self._control.append(payload)
+        self._wakeup.set()
+
+    def _mark_ready(self, ch: ConversationChannel) -> None:
+        if ch.sendable() and ch.conversation_id not in self._ready_set:
+            self._ready.append(ch.conversation_id)
+            self._ready_set.add(ch.conversation_id)
+            self._wakeup.set()
+
+    # -------- writer --------
+
+    def _next_event(self) -> Optional[Event | Dict[str, Any]]:
+        if self._control:
+            return self._control.popleft()
+
+        while self._ready:
+            conv_id = self._ready.popleft()
+            self._ready_set.discard(conv_id)
+            ch = self.channels.get(conv_id)
+            if ch is None or not ch.sendable():
+                continue
+            ev = ch.queue.popleft()
+            if ch.credits is not None:
+                ch.credits -= 1
+            # round-robin: go to the back of the ring if more is sendable
+            self._mark_ready(ch)
+            return ev
+        return None
+
+    async def _writer_loop(self) -> None:
+        while not self.closed:
+            ev = self._next_event()
+            if ev is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                turn = tracer.active.get(ev.conversation_id) if tracer.active and isinstance(ev, Event) else None
+                if turn is None:
+                    await self._write(ev)
+                else:
+                    with turn.span("send", sequence=ev.sequence, transport=type(self).__name__):
+                        await self._write(ev)
+            except Exception:
+                # client went away; the receive loop will notice and clean up
+                self.closed = True
+                return
+
+    async def _write(self, ev: Event | Dict[str, Any]) -> None:
+        if isinstance(ev, Event):
+            # serialized once and shared with the buffer / other subscribers
+            await self.websocket.send_text(ev.to_json())
+        else:
+            await self.websocket.send_json(ev)
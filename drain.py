@@ -0,0 +1,171 @@
+"""Graceful drain and hand-off when a worker is shut down.
+
+On SIGTERM (or `POST /admin/drain`) the worker stops admitting new sockets
+and generations, lets running generations finish up to `DRAIN_DEADLINE_SECONDS`
+and cancels whatever is left, tells every subscriber to reconnect and
+`resume`, flushes status writes and the event buffer, and saves conversation
+records and graph checkpoints as a JSON file of its own in `DRAIN_STATE_DIR`.
+The next worker to start loads every file there, so resumed clients find
+their sequence numbers and pending action cards where they left them. Each
+phase is timed like the startup warm-up.
+"""
+import asyncio
+import base64
+import json
+import os
+import socket
+import tempfile
+import time
+from typing import Any, Dict
+
+from services.utils.executors import run_io
+from services.utils.paths import backend_path
+
+DRAIN_DEADLINE_SECONDS = float(os.getenv("DRAIN_DEADLINE_SECONDS", "25"))
+# must be on a volume the replacement worker can read (shared when it runs on another host)
+DRAIN_STATE_DIR = backend_path(os.getenv("DRAIN_STATE_DIR", "drain_state"))
+# time given to connection writers to send the reconnect notice before the sockets close
+DRAIN_NOTIFY_SECONDS = float(os.getenv("DRAIN_NOTIFY_SECONDS", "0.5"))
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _encode(value: Any) -> Any:
+    """JSON-safe copy of the state: bytes, tuples and non-string dict keys are tagged."""
+    if isinstance(value, bytes):
+        return {"$b": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, tuple):
+        return {"$t": [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        if all(isinstance(k, str) and not k.startswith("$") for k in value):
+            return {k: _encode(v) for k, v in value.items()}
+        return {"$d": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"cannot hand off {type(value).__name__}")
+
+
+def _decode(obj: Dict[str, Any]) -> Any:
+    # json object_hook: inner values are already decoded
+    if len(obj) == 1:
+        if "$b" in obj:
+            return base64.b64decode(obj["$b"])
+        if "$t" in obj:
+            return tuple(obj["$t"])
+        if "$d" in obj:
+            return {k: v for k, v in obj["$d"]}
+    return obj
+
+
+def _save(state: Dict[str, Any], directory: str) -> str:
+    """Write this worker's state file: unique temp file, then an atomic rename."""
+    os.makedirs(directory, exist_ok=True)
+    data = json.dumps(_encode(state))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{_worker_id()}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        path = os.path.join(directory, f"{_worker_id()}-{time.time_ns()}.json")
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+
+async def drain(orch, buffer, guard, deadline: float = DRAIN_DEADLINE_SECONDS, directory: str = DRAIN_STATE_DIR) -> Dict[str, Any]:
+    """Run all drain phases; returns per-phase timings in ms (or the error) and counts."""
+    from services.utils import status
+
+    report: Dict[str, Any] = {}
+
+    async def _phase(name: str, fn):
+        started = time.monotonic()
+        try:
+            result = await fn()
+            report[name] = round((time.monotonic() - started) * 1000, 1)
+            if result is not None:
+                report[f"{name}_count"] = result
+        except Exception as e:
+            report[name] = f"failed: {e}"
+
+    orch.draining = True
+    guard.draining = True
+
+    async def _finish_generations():
+        tasks = orch.running_tasks()
+        if tasks:
+            await asyncio.wait(tasks, timeout=deadline)
+        left = [
+            conv for conv in orch.conversations.values()
+            if conv.current_task is not None and not conv.current_task.done()
+        ]
+        await asyncio.gather(*(orch._cancel_run(conv, "shutdown") for conv in left))
+        report["generations_cancelled"] = len(left)
+        return len(tasks)
+
+    async def _notify():
+        notified = orch.notify_reconnect()
+        await asyncio.sleep(DRAIN_NOTIFY_SECONDS)
+        return notified
+
+    async def _close_status_writers():
+        return await status.close_writers()
+
+    async def _flush_buffer():
+        if buffer.archive is not None:
+            # let archive passes already scheduled finish first
+            await buffer.archive.join()
+        report["buffer_unflushed"] = await run_io(buffer.flush)
+
+    async def _save_state():
+        if not directory:
+            return None
+        state = orch.export_state()
+        report["state_file"] = await run_io(_save, state, directory)
+        return len(state["conversations"])
+
+    await _phase("generations", _finish_generations)
+    await _phase("notify", _notify)
+    await _phase("status_writes", _close_status_writers)
+    await _phase("buffer", _flush_buffer)
+    await _phase("state", _save_state)
+    return report
+
+
+def load_state(orch, directory: str = DRAIN_STATE_DIR) -> int:
+    """Restore what drained workers saved in `directory`.
+
+    Each file is claimed by renaming it first, so workers starting together
+    never load the same one. Loaded files are removed; unreadable ones are
+    logged and moved aside as `*.bad` so they cannot fail the next start.
+    Returns the number of conversations restored.
+    """
+    if not directory or not os.path.isdir(directory):
+        return 0
+    restored = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        claimed = f"{path}.{_worker_id()}.loading"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue  # another worker claimed it
+        try:
+            with open(claimed, "r", encoding="utf-8") as f:
+                state = json.load(f, object_hook=_decode)
+            restored += orch.import_state(state)
+        except Exception as e:
+            print(f"[DRAIN] cannot restore {name}, moved aside: {e}")
+            os.replace(claimed, f"{path}.bad")
+            continue
+        os.remove(claimed)
+    return restored
@@ -1,26 +1,147 @@
 """Event builder utilities and constants.
 
 Provides helpers to build the unified envelope with server-side event_id, sequence, and timestamp.
+
+Event ids are generated from a per-process random prefix plus a counter by
+default (no syscall per event). Set `EVENT_ID_MODE=uuid` for deployments that
+need random UUID4 ids. Timestamps come from a coarse clock that is refreshed
+by a background task (see `CoarseClock.run`); without that task running they
+fall back to `time.time()`.
+
+`Event` is the compact in-process form of an envelope: a slotted record that
+is serialized to JSON once, on first use, and then shared by the buffer and
+every connection that sends it.
 """
+import asyncio
+import itertools
+import json
+import os
 import time
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+EVENT_ID_MODE = os.getenv("EVENT_ID_MODE", "sequential")
+CLOCK_RESOLUTION_MS = int(os.getenv("EVENT_CLOCK_RESOLUTION_MS", "10"))
+
+
+class EventIdGenerator:
+    """Monotonic per-process event ids: `<random prefix>-<counter in hex>`.
+
+    The prefix is drawn once per process from os.urandom (and again in
+    every forked child, e.g. gunicorn workers with preload), so ids stay
+    unique across workers and restarts while each call is just a counter
+    bump.
+    """
+
+    def __init__(self, mode: str = EVENT_ID_MODE):
+        self.mode = mode
+        self.reseed()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reseed)
+
+    def reseed(self) -> None:
+        self.prefix = uuid.uuid4().hex[:12]
+        self._counter = itertools.count(1)
+
+    def next_id(self) -> str:
+        if self.mode == "uuid":
+            return str(uuid.uuid4())
+        return f"{self.prefix}-{next(self._counter):x}"
+
+
+class CoarseClock:
+    """Millisecond wall clock cached at a fixed resolution."""
+
+    def __init__(self, resolution_ms: int = CLOCK_RESOLUTION_MS):
+        self.resolution = resolution_ms / 1000
+        self._now_ms = 0
+        self._running = False
+
+    def now_ms(self) -> int:
+        if not self._running:
+            return int(time.time() * 1000)
+        return self._now_ms
+
+    async def run(self) -> None:
+        """Refresh the cached time until cancelled."""
+        self._running = True
+        try:
+            while True:
+                self._now_ms = int(time.time() * 1000)
+                await asyncio.sleep(self.resolution)
+        finally:
+            self._running = False
+
+
+event_ids = EventIdGenerator()
+clock = CoarseClock()
+
 
 def now_ts_ms() -> int:
-    return int(time.time() * 1000)
+    return clock.now_ms()
+
+
+class Event:
+    __slots__ = ("type", "conversation_id", "event_id", "sequence", "ts", "payload", "user_id", "_json")
+
+    def __init__(
+        self,
+        type: str,
+        conversation_id: str,
+        event_id: Optional[str],
+        sequence: int,
+        ts: Optional[int],
+        payload: Dict[str, Any],
+        user_id: Optional[str] = None,
+        raw: Optional[str] = None,
+    ):
+        self.type = type
+        self.conversation_id = conversation_id
+        self.event_id = event_id
+        self.sequence = sequence
+        self.ts = ts
+        self.payload = payload
+        self.user_id = user_id
+        self._json = raw
+
+    def to_dict(self) -> Dict[str, Any]:
+        ev = {
+            "type": self.type,
+            "conversation_id": self.conversation_id,
+            "event_id": self.event_id,
+            "sequence": self.sequence,
+            "ts": self.ts,
+            "payload": self.payload,
+        }
+        if self.user_id:
+            ev["user_id"] = self.user_id
+        return ev
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self.to_dict())
+        return self._json
+
+    @classmethod
+    def from_json(cls, raw: str) -> "Event":
+        """Rebuild a buffered event, keeping `raw` so it is not re-serialized."""
+        d = json.loads(raw)
+        return cls(
+            d.get("type"),
+            d.get("conversation_id"),
+            d.get("event_id"),
+            d.get("sequence", 0),
+            d.get("ts"),
+            d.get("payload", {}),
+            d.get("user_id"),
+            raw,
+        )
 
 
-def make_event(event_type: str, conversation_id: str, sequence: int, payload: Dict[str, Any]) -> Dict[str, Any]:
-    """Constructs a unified envelope event for sending to clients.
+def new_event(event_type: str, conversation_id: str, sequence: int, payload: Dict[str, Any], user_id: Optional[str] = None) -> Event:
+    """Build an outbound event with a server-generated `event_id` and `ts`.
 
-    Server generates `event_id` (UUID) and `ts` (ms since epoch). The caller is responsible
-    for incrementing the conversation sequence and passing it in.
+    The caller is responsible for incrementing the conversation sequence
+    and passing it in.
     """
-    return {
-        "type": event_type,
-        "conversation_id": conversation_id,
-        "event_id": str(uuid.uuid4()),
-        "sequence": sequence,
-        "ts": now_ts_ms(),
-        "payload": payload,
-    }
+    return Event(event_type, conversation_id, event_ids.next_id(), sequence, now_ts_ms(), payload, user_id)
@@ -0,0 +1,132 @@
+"""Idempotent handling of inbound client events.
+
+Clients stamp every `user_message` / `action` with an `event_id` and resend
+it after a flaky reconnect. `InboundDedup` remembers, per conversation, the
+event ids that already started a run together with the sequence the run
+started from, so a retry can be answered by replaying that run instead of
+launching (and paying for) a second generation.
+
+Entries live in a bounded, TTL'd in-process cache. With
+`IDEMPOTENCY_BACKEND=redis` they are also claimed in Redis (SET NX), so a
+retry that lands on another worker is recognized too. Redis calls run in
+the I/O pool; when Redis fails, claims stay local for `REDIS_RETRY_SECONDS`
+before Redis is tried again.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from services.utils.executors import run_io
+
+REDIS_RETRY_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS", "5"))
+
+
+class InboundDedup:
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 100_000, redis_url: Optional[str] = None):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        # (conversation_id, event_id) -> (start_sequence, expires_at), oldest first
+        self._seen: "OrderedDict[Tuple[str, str], Tuple[int, float]]" = OrderedDict()
+        self.redis = None
+        # Redis is skipped until this monotonic time after a failure
+        self.redis_retry_at = 0.0
+        if redis_url:
+            import redis
+
+            self.redis = redis.Redis.from_url(redis_url, decode_responses=True, socket_timeout=1.0)
+
+        self.duplicates = 0
+        self.redis_errors = 0
+
+    @classmethod
+    def from_env(cls) -> "InboundDedup":
+        backend = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+        redis_url = None
+        if backend == "redis":
+            redis_url = os.getenv("IDEMPOTENCY_REDIS_URL") or os.getenv("REDIS_URL", "redis://localhost:6379")
+        return cls(
+            ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "300")),
+            max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000")),
+            redis_url=redis_url,
+        )
+
+    def _key(self, conversation_id: str, event_id: str) -> str:
+        return f"idem:{{{conversation_id}}}:{event_id}"
+
+    def _evict(self, now: float) -> None:
+        while self._seen:
+            key, (_, expires_at) = next(iter(self._seen.items()))
+            if expires_at > now and len(self._seen) <= self.max_entries:
+                break
+            del self._seen[key]
+
+    def _redis_ready(self, now: float) -> bool:
+        return self.redis is not None and now >= self.redis_retry_at
+
+    def _redis_failed(self, error: Exception) -> None:
+        # dedup is best-effort; never block a message on it
+        if self.redis_retry_at <= time.monotonic():
+            print(f"[IDEMPOTENCY] redis unavailable, using local claims for {REDIS_RETRY_SECONDS:g}s: {error}")
+        self.redis_errors += 1
+        self.redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+
+    def _redis_claim(self, rkey: str, start_sequence: int) -> Optional[str]:
+        if self.redis.set(rkey, start_sequence, nx=True, ex=self.ttl):
+            return None
+        return self.redis.get(rkey)
+
+    async def claim(self, conversation_id: str, event_id: str, start_sequence: int) -> Optional[int]:
+        """
+        Record `event_id` as starting a run at `start_sequence`.
+
+        Returns None the first time an event id is seen, otherwise the start
+        sequence recorded for it.
+        """
+        now = time.monotonic()
+        key = (conversation_id, event_id)
+        hit = self._seen.get(key)
+        if hit is not None and hit[1] > now:
+            self.duplicates += 1
+            return hit[0]
+
+        # claimed locally before awaiting Redis, so a retry racing this one
+        # on the same worker is caught above
+        self._seen[key] = (start_sequence, now + self.ttl)
+        self._seen.move_to_end(key)
+        self._evict(now)
+
+        if self._redis_ready(now):
+            try:
+                recorded = await run_io(self._redis_claim, self._key(conversation_id, event_id), start_sequence)
+            except Exception as e:
+                self._redis_failed(e)
+            else:
+                if recorded is not None:
+                    # another worker started this run
+                    self.duplicates += 1
+                    self._seen[key] = (int(recorded), now + self.ttl)
+                    return int(recorded)
+        return None
+
+    async def forget(self, conversation_id: str, event_id: Optional[str]) -> None:
+        """Drop a claim whose event was rejected, so the client may retry it."""
+        if not event_id:
+            return
+        self._seen.pop((conversation_id, event_id), None)
+        if self._redis_ready(time.monotonic()):
+            try:
+                await run_io(self.redis.delete, self._key(conversation_id, event_id))
+            except Exception as e:
+                self._redis_failed(e)
+
+    def cleanup(self) -> None:
+        """Drop expired claims (otherwise only done on the next claim)."""
+        self._evict(time.monotonic())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._seen),
+            "duplicates": self.duplicates,
+            "redis_errors": self.redis_errors,
+        }
@@ -0,0 +1,146 @@
+"""Per-conversation inbound mailbox.
+
+Work-starting client events (`user_message`, `action`) are posted to the
+conversation's mailbox and handled by a single worker coroutine, so the
+socket's receive loop never waits on a generation and a conversation never
+handles two of them at once. What happens to a burst of messages depends on
+the policy:
+
+- `queue`: every message becomes its own turn, in order, each one waiting
+  for the previous run to finish.
+- `coalesce`: like `queue`, but consecutive pending user messages are merged
+  into a single turn.
+- `latest`: latest wins. A new user message replaces the ones still queued
+  and supersedes the running generation. While a generation is running, or
+  when messages arrive in a burst, it first waits for a short debounce so
+  a burst costs one superseded run; otherwise it starts right away. Actions
+  are never delayed.
+
+The worker only exists while there is work, so idle conversations cost
+nothing beyond the empty mailbox.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Tuple
+
+from schemas import InboundEnvelope
+
+POLICY_QUEUE = "queue"
+POLICY_COALESCE = "coalesce"
+POLICY_LATEST = "latest"
+
+INBOUND_POLICY = os.getenv("INBOUND_POLICY", POLICY_LATEST)
+INBOUND_DEBOUNCE_MS = int(os.getenv("INBOUND_DEBOUNCE_MS", "150"))
+INBOUND_MAILBOX_SIZE = int(os.getenv("INBOUND_MAILBOX_SIZE", "16"))
+
+# handler(connection, envelope, posted_at_ns)
+Handler = Callable[[Any, InboundEnvelope, int], Awaitable[None]]
+
+
+class Mailbox:
+    __slots__ = ("handler", "busy", "wait_idle", "policy", "debounce", "max_size", "items", "_worker", "_posted", "_posted_at", "_gap")
+
+    def __init__(
+        self,
+        handler: Handler,
+        busy: Callable[[], bool] = lambda: False,
+        wait_idle: Optional[Callable[[], Awaitable[None]]] = None,
+        policy: str = INBOUND_POLICY,
+        debounce_ms: int = INBOUND_DEBOUNCE_MS,
+        max_size: int = INBOUND_MAILBOX_SIZE,
+    ):
+        self.handler = handler
+        # True while the conversation has a generation running
+        self.busy = busy
+        # returns once that generation has finished (queue / coalesce)
+        self.wait_idle = wait_idle
+        self.policy = policy
+        self.debounce = debounce_ms / 1000
+        self.max_size = max_size
+        # (connection, envelope, posted_at_ns) in arrival order
+        self.items: Deque[Tuple[Any, InboundEnvelope, int]] = deque()
+        self._worker: Optional[asyncio.Task] = None
+        # bumped on every post so the debounce can tell if more arrived
+        self._posted = 0
+        # monotonic time of the last post, and its distance to the one before
+        self._posted_at = 0.0
+        self._gap = float("inf")
+
+    def post(self, conn, envelope: InboundEnvelope) -> bool:
+        """Queue an inbound event. Returns False if the mailbox is full."""
+        if self.policy == POLICY_LATEST and envelope.type == "user_message":
+            self.items = deque(item for item in self.items if item[1].type != "user_message")
+        if len(self.items) >= self.max_size:
+            return False
+
+        self.items.append((conn, envelope, time.time_ns()))
+        self._posted += 1
+        now = time.monotonic()
+        self._gap = now - self._posted_at
+        self._posted_at = now
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+        return True
+
+    def clear(self) -> int:
+        """Drop everything not yet handled (e.g. on `stop`)."""
+        dropped = len(self.items)
+        self.items.clear()
+        return dropped
+
+    def close(self) -> None:
+        """Drop pending events and stop the worker (conversation evicted)."""
+        self.items.clear()
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+
+    def _next(self) -> Tuple[Any, InboundEnvelope, int]:
+        conn, envelope, posted_ns = self.items.popleft()
+        if self.policy != POLICY_COALESCE or envelope.type != "user_message":
+            return conn, envelope, posted_ns
+
+        texts = [envelope.payload.text]
+        while self.items and self.items[0][1].type == "user_message":
+            conn, envelope, _ = self.items.popleft()
+            texts.append(envelope.payload.text)
+        if len(texts) == 1:
+            return conn, envelope, posted_ns
+
+        # the merged turn answers to the newest message (its event_id, its sender)
+        payload = envelope.payload.model_copy(update={"text": "\n".join(t for t in texts if t)})
+        # timed from the first message of the merged burst
+        return conn, envelope.model_copy(update={"payload": payload}), posted_ns
+
+    def _should_debounce(self) -> bool:
+        return (
+            self.policy == POLICY_LATEST
+            and self.debounce > 0
+            and self.items[0][1].type == "user_message"
+            and (self.busy() or self._gap < self.debounce)
+        )
+
+    async def _drain(self) -> None:
+        while self.items:
+            if self.policy != POLICY_LATEST and self.wait_idle is not None and self.busy():
+                # the next turn stays queued until the running one ends, so a
+                # `stop` meanwhile (which clears the mailbox) still drops it
+                await self.wait_idle()
+                if not self.items:
+                    break
+            elif self._should_debounce():
+                # wait until the burst settles
+                while True:
+                    posted = self._posted
+                    await asyncio.sleep(self.debounce)
+                    if posted == self._posted:
+                        break
+                if not self.items:
+                    break
+
+            conn, envelope, posted_ns = self._next()
+            try:
+                await self.handler(conn, envelope, posted_ns)
+            except Exception as e:
+                print(f"[MAILBOX] handling {envelope.type} failed: {e}")
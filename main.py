@@ -1,12 +1,25 @@
 """FastAPI application exposing the WebSocket `/chat/stream` endpoint.
 
+For clients behind proxies that break WebSockets, the same conversations are
+also served over HTTP: `POST /chat` for client events and
+`GET /chat/stream/sse` for the event stream.
+
 This module wires the WebSocket gateway to the orchestrator and runs a periodic
 cleanup task for the event buffer retention window.
+
+Importing this module is kept cheap: the LangGraph/LangChain/OpenAI stack,
+prompts, graph and connection pools are warmed in the background after startup
+(see `warmup.py`), and `/readyz` only reports ready once that has finished.
+
+On SIGTERM the worker drains before exiting (see `drain.py`): it stops
+admitting work, lets generations finish, tells clients to reconnect with
+`resume` and hands conversation state to the next worker.
 """
 import asyncio
-import json
 import os
+import signal
 import sys
+import time
 from pathlib import Path
 
 # Get the current directory (where main.py is located)
@@ -15,19 +28,36 @@ CURRENT_DIR = Path(__file__).parent.resolve()
 # Set VB_BACKEND_DIR to current directory or environment variable if provided
 VB_BACKEND_DIR = Path(os.environ.get("VB_BACKEND_DIR", str(CURRENT_DIR))).resolve()
 
-# ทำให้ relative path ใน VB-BACKEND (เช่น prompts/...) ทำงานได้
-os.chdir(VB_BACKEND_DIR)
-
 # ทำให้ import `services.*` จาก VB-BACKEND ได้ชัวร์
 if str(VB_BACKEND_DIR) not in sys.path:
     sys.path.insert(0, str(VB_BACKEND_DIR))
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+# relative file settings (archive, traces, drain state) resolve against this
+# directory (see services/utils/paths.py), whatever the launch directory is
+os.environ["VB_BACKEND_DIR"] = str(VB_BACKEND_DIR)
+
+# .env must be loaded before the project modules below read their settings
+from dotenv import load_dotenv
+
+load_dotenv(VB_BACKEND_DIR / ".env")
+
+from fastapi import FastAPI, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 
-from buffer import EventBuffer
+from buffer import create_buffer
+from connection import ClientConnection
+from drain import drain, load_state
+from events import clock
 from orchestrator import Orchestrator
+from overload import OverloadGuard, overload_error
+from schemas import MAX_FRAME_BYTES, FrameTooLarge, decode_envelope, describe_error
+from services.utils import executors
+from services.utils.llm import check_config
+from services.utils.prompt_manager import prompt_registry
+from services.utils.tracing import tracer
+from sse import SSEConnection, last_event_id
+from warmup import warm_up
 
 app = FastAPI()
 
@@ -40,19 +70,171 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-buffer = EventBuffer()
-orch = Orchestrator(buffer)
+buffer = create_buffer()
+guard = OverloadGuard.from_env()
+orch = Orchestrator(buffer, overload=guard)
+
+# Application-level heartbeat: the server sends {"type": "ping"} this often;
+# clients that answer with {"type": "pong"} are closed as half-open when
+# nothing arrives within interval + timeout
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+WS_PONG_TIMEOUT_SECONDS = float(os.getenv("WS_PONG_TIMEOUT_SECONDS", "10"))
+half_open_closed = 0
+
+# Client events charged against the per-connection rate limit
+RATE_LIMITED_EVENTS = ("user_message", "action")
+
+# Seconds between buffer cleanup / idle conversation eviction passes
+CLEANUP_INTERVAL_SECONDS = float(os.getenv("CLEANUP_INTERVAL_SECONDS", "30"))
+
+# Seconds between prompt file change checks (0 disables hot reload)
+PROMPT_RELOAD_SECONDS = float(os.getenv("PROMPT_RELOAD_SECONDS", "2"))
+
+# Flipped by _warm_up once imports, prompts, graph and connection pools are warm
+ready = False
+warmup_report = {}
+
+
+async def _warm_up():
+    global ready, warmup_report
+    warmup_report = await warm_up(orch, buffer)
+    ready = True
+    print(f"Warm-up complete, worker is ready: {warmup_report}")
+
+
+# Set while draining for shutdown; the report is kept for /metrics
+drain_task = None
+drain_report = {}
+
+
+def _start_drain(exit_after: bool) -> asyncio.Task:
+    global drain_task
+
+    async def _drain():
+        global drain_report
+        print("Draining worker...")
+        drain_report = await drain(orch, buffer, guard)
+        print(f"Drain complete: {drain_report}")
+        if exit_after:
+            # hand over to uvicorn's own shutdown (closes sockets, runs shutdown hooks)
+            signal.raise_signal(signal.SIGINT)
+
+    if drain_task is None:
+        drain_task = asyncio.create_task(_drain())
+    return drain_task
 
 
 @app.on_event("startup")
 async def startup_tasks():
+    check_config()
+
     # Start a background task to cleanup old buffer entries periodically
     async def _cleanup_loop():
         while True:
             buffer.cleanup()
-            await asyncio.sleep(30)
+            orch.dedup.cleanup()
+            evicted = orch.evict_idle()
+            if evicted:
+                print(f"Evicted {evicted} idle conversations")
+            await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
 
     asyncio.create_task(_cleanup_loop())
+    # Keep the coarse event clock fresh so new_event avoids a time() call per token
+    asyncio.create_task(clock.run())
+    # Feed event-loop lag into the overload guard
+    asyncio.create_task(guard.monitor_loop_lag())
+
+    async def _prompt_reload_loop():
+        while True:
+            await asyncio.sleep(PROMPT_RELOAD_SECONDS)
+            changed = prompt_registry.reload_if_changed()
+            if changed:
+                print(f"Reloaded prompts: {changed}")
+
+    if PROMPT_RELOAD_SECONDS > 0:
+        asyncio.create_task(_prompt_reload_loop())
+
+    asyncio.create_task(_warm_up())
+
+    restored = load_state(orch)
+    if restored:
+        print(f"Restored {restored} conversations from the previous worker")
+
+    # replaces uvicorn's SIGTERM handler (installed before startup): drain first, then exit
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, _start_drain, True)
+    except (NotImplementedError, RuntimeError):
+        # no loop signal handlers (Windows) or not the main thread (tests)
+        pass
+
+
+@app.on_event("shutdown")
+async def shutdown_tasks():
+    executors.shutdown()
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and the event loop answers."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 503 until the startup warm-up has finished, and while draining."""
+    if not ready or drain_task is not None:
+        return JSONResponse({"ready": False, "draining": drain_task is not None}, status_code=503)
+    return {"ready": True, "warmup_ms": warmup_report}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for operators (JSON)."""
+    return {
+        "admission": orch.admission.snapshot(),
+        "overload": guard.snapshot(),
+        "cancellation": orch.cancel_metrics.snapshot(),
+        "idempotency": orch.dedup.snapshot(),
+        "heartbeat": {"half_open_closed": half_open_closed, "orphans_cancelled": orch.orphans_cancelled},
+        "conversations": {"live": len(orch.conversations), "evicted": orch.conversations_evicted},
+        "buffer": buffer.snapshot(),
+        "executors": executors.snapshot(),
+        "drain": {"draining": drain_task is not None, **drain_report},
+    }
+
+
+@app.post("/admin/drain")
+async def admin_drain(exit: bool = False, wait: bool = True):
+    """Drain this worker as on SIGTERM; with `exit=true` it shuts down afterwards."""
+    task = _start_drain(exit)
+    if wait:
+        await asyncio.shield(task)
+    return {"draining": True, "report": drain_report}
+
+
+@app.get("/debug/trace/{conversation_id}")
+async def debug_trace(conversation_id: str):
+    """Recent sampled turns of a conversation as OTLP JSON (`resourceSpans`)."""
+    turns = tracer.turns(conversation_id)
+    if not turns:
+        return JSONResponse({"error": "no traced turns for this conversation"}, status_code=404)
+    return {"resourceSpans": [rs for turn in turns for rs in turn.to_otlp()["resourceSpans"]]}
+
+
+@app.post("/debug/trace/{conversation_id}")
+async def debug_trace_watch(conversation_id: str, enabled: bool = True):
+    """Trace every turn of a conversation (or stop, with `enabled=false`)."""
+    if enabled:
+        tracer.watch(conversation_id)
+    else:
+        tracer.unwatch(conversation_id)
+    return {"conversation_id": conversation_id, "watched": enabled}
+
+
+async def _send_pings(conn: ClientConnection):
+    while not conn.closed:
+        await asyncio.sleep(WS_PING_INTERVAL_SECONDS)
+        conn.send_control({"type": "ping", "payload": {"ts": int(time.time() * 1000)}})
 
 
 @app.websocket("/chat/stream")
@@ -60,32 +242,94 @@ async def chat_stream(ws: WebSocket):
     """WebSocket entrypoint for bidirectional streaming chat.
 
     Clients MUST send and receive messages following the unified envelope.
-    Supported client events: `user_message`, `action`, `resume`, `stop`.
+    Supported client events: `user_message`, `action`, `resume`, `stop`,
+    `subscribe`, `unsubscribe`, `credit`.
     Server emits: `token`, `status`, `card`, `done`, `error`.
+
+    One socket may carry any number of conversations; outbound events are
+    multiplexed per conversation by `ClientConnection`.
+
+    When the worker is overloaded the socket is accepted only to deliver an
+    `error` event with `code` and `retry_after_ms`, then closed with 1013.
+
+    The server sends `ping` every WS_PING_INTERVAL_SECONDS. Once a client has
+    answered one with `pong`, silence longer than interval + timeout closes
+    the socket as half-open. Clients may also send `ping` and get a `pong`.
     """
+    global half_open_closed
     await ws.accept()
+    retry_after = guard.admit_socket()
+    if retry_after is not None:
+        await ws.send_json({
+            "type": "error",
+            "payload": overload_error("overloaded", "server is busy, retry later", retry_after),
+        })
+        await ws.close(code=1013)
+        return
+
+    conn = ClientConnection(ws)
+    conn.start()
+    pinger = asyncio.create_task(_send_pings(conn))
+    # set once the client answers a ping; clients without pong support are never timed out
+    heartbeat = False
+    bucket = guard.rate_limiter()
     try:
         while True:
             try:
-                data = await ws.receive_text()
                 try:
-                    envelope = json.loads(data)
+                    data = await asyncio.wait_for(
+                        ws.receive_text(),
+                        WS_PING_INTERVAL_SECONDS + WS_PONG_TIMEOUT_SECONDS if heartbeat else None,
+                    )
+                except asyncio.TimeoutError:
+                    half_open_closed += 1
+                    print("Half-open connection, closing")
+                    try:
+                        await asyncio.wait_for(ws.close(code=1001), 1.0)
+                    except Exception:
+                        pass
+                    return
+                try:
+                    # size check, JSON parse and schema validation in one step
+                    envelope = decode_envelope(data)
                     print("⬅", envelope)
-                except json.JSONDecodeError as e:
-                    await ws.send_json({
+                except ValueError as e:
+                    conn.send_control({
                         "type": "error", 
                         "payload": {
-                            "message": f"invalid json: {str(e)}"
+                            "message": f"invalid envelope: {describe_error(e)}",
+                            "code": "frame_too_large" if isinstance(e, FrameTooLarge) else "invalid_envelope",
                         }
                     })
                     continue
 
+                if envelope.type == "pong":
+                    heartbeat = True
+                    continue
+                if envelope.type == "ping":
+                    conn.send_control({"type": "pong", "payload": envelope.payload})
+                    continue
+
+                # only frames that start work are charged; control frames
+                # (subscribe, credit, stop, ...) always pass
+                if envelope.type in RATE_LIMITED_EVENTS:
+                    retry_after = guard.rate_limited(bucket)
+                    if retry_after is not None:
+                        conn.send_control({
+                            "type": "error",
+                            "conversation_id": envelope.conversation_id,
+                            "payload": overload_error("rate_limited", "too many messages", retry_after),
+                        })
+                        continue
+
                 # Delegate to orchestrator
-                await orch.handle_incoming(ws, envelope)
+                await orch.handle_incoming(conn, envelope)
 
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 print(f"Error processing message: {e}")
-                await ws.send_json({
+                conn.send_control({
                     "type": "error", 
                     "payload": {
                         "message": f"server error: {str(e)}"
@@ -107,3 +351,92 @@ async def chat_stream(ws: WebSocket):
         except:
             pass  # Connection might be closed already
         return
+    finally:
+        pinger.cancel()
+        guard.release_socket()
+        orch.detach(conn)
+        await conn.close()
+
+
+# Client events accepted over plain HTTP (subscriptions are implied by the SSE stream)
+HTTP_CLIENT_EVENTS = ("user_message", "action", "stop")
+
+
+@app.post("/chat")
+async def chat_post(request: Request):
+    """Send one client event (`user_message`, `action` or `stop`) over HTTP.
+
+    The body is the unified envelope. Output is delivered on the
+    conversation's SSE stream (or any WebSocket subscribed to it).
+    """
+    # reject oversized bodies before reading them when the client declares the size
+    try:
+        declared = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        return JSONResponse({"error": "invalid Content-Length header"}, status_code=400)
+    if declared > MAX_FRAME_BYTES:
+        return JSONResponse({"error": f"body exceeds {MAX_FRAME_BYTES} bytes"}, status_code=413)
+    try:
+        envelope = decode_envelope(await request.body())
+    except FrameTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except ValueError as e:
+        return JSONResponse({"error": f"invalid envelope: {describe_error(e)}"}, status_code=400)
+    if envelope.type not in HTTP_CLIENT_EVENTS:
+        return JSONResponse({"error": f"type must be one of {', '.join(HTTP_CLIENT_EVENTS)}"}, status_code=400)
+    if orch.draining and envelope.type != "stop":
+        return JSONResponse(
+            {"type": "error", "payload": overload_error("draining", "server is restarting, retry", guard.retry_after_ms)},
+            status_code=503,
+            headers={"Retry-After": str(max(1, guard.retry_after_ms // 1000))},
+        )
+
+    await orch.handle_incoming(None, envelope)
+    conv = orch.conversations[envelope.conversation_id]
+    return JSONResponse({"conversation_id": conv.id, "last_sequence": conv.sequence}, status_code=202)
+
+
+@app.get("/chat/stream/sse")
+async def chat_stream_sse(
+    conversation_id: str,
+    last_sequence: int | None = None,
+    last_event_id_header: str | None = Header(None, alias="Last-Event-ID"),
+):
+    """Server-Sent Events stream of one conversation.
+
+    Each event's SSE `id` is its `sequence`; reconnecting with `Last-Event-ID`
+    (or `last_sequence`) replays what was missed from the event buffer.
+    """
+    retry_after = guard.admit_socket()
+    if retry_after is not None:
+        return JSONResponse(
+            {"type": "error", "payload": overload_error("overloaded", "server is busy, retry later", retry_after)},
+            status_code=503,
+            headers={"Retry-After": str(max(1, retry_after // 1000))},
+        )
+
+    conn = SSEConnection()
+    conn.start()
+    try:
+        await orch.attach(conn, conversation_id, last_event_id(last_event_id_header, last_sequence))
+    except BaseException:
+        # the body below never runs, so give the slot back here
+        guard.release_socket()
+        orch.detach(conn)
+        await conn.close()
+        raise
+
+    async def _body():
+        try:
+            async for frame in conn.stream():
+                yield frame
+        finally:
+            guard.release_socket()
+            orch.detach(conn)
+            await conn.close()
+
+    return StreamingResponse(
+        _body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
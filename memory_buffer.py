@@ -0,0 +1,246 @@
+"""
+In-process event buffer for single-node deployments, benchmarks and tests.
+
+Same interface as the Redis `EventBuffer` (append / replay / replay_events /
+cleanup), without a network round trip per token. Each conversation keeps a
+fixed-capacity ring of `Event` records indexed by sequence, so a replay is a
+bisect plus a slice. Conversations are kept in LRU order: the least recently
+used ones are evicted when the global memory cap is reached, and `cleanup`
+(driven by the cleanup loop in main.py) expires conversations idle longer
+than the TTL. Evicted and completed conversations go to the cold archive
+when one is configured, exactly like the Redis backend: each pass stores
+only the events after the ring's `archived` mark, in the I/O pool.
+"""
+import bisect
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from archive import DEFAULT_PATH as ARCHIVE_PATH, EventArchive
+from events import Event
+from services.utils.executors import run_io
+
+RING_CAPACITY = int(os.getenv("EVENT_BUFFER_RING_CAPACITY", "5000"))
+MAX_BYTES = int(os.getenv("EVENT_BUFFER_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# rough per-event cost on top of the JSON text (Event record, payload dict, list slots)
+_EVENT_OVERHEAD = 200
+
+
+class EventRing:
+    """Fixed-capacity, sequence-ordered event log of one conversation.
+
+    Dropping the oldest event only advances `start`; the lists are compacted
+    once the dead prefix reaches the capacity, so appends stay O(1) amortized.
+    """
+
+    __slots__ = ("capacity", "sequences", "events", "start", "bytes", "touched", "archived")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.sequences: List[int] = []
+        self.events: List[Event] = []
+        self.start = 0
+        self.bytes = 0
+        self.touched = time.monotonic()
+        # sequence the archive holds this conversation up to
+        self.archived = 0
+
+    def __len__(self) -> int:
+        return len(self.events) - self.start
+
+    def append(self, event: Event, size: int) -> int:
+        """Add an event; returns the bytes released by dropping old ones."""
+        self.sequences.append(event.sequence)
+        self.events.append(event)
+        self.bytes += size
+
+        released = 0
+        while len(self) > self.capacity:
+            released += _size(self.events[self.start])
+            self.events[self.start] = None
+            self.start += 1
+        if self.start >= self.capacity:
+            del self.sequences[: self.start]
+            del self.events[: self.start]
+            self.start = 0
+        self.bytes -= released
+        return released
+
+    def since(self, last_sequence: int) -> List[Event]:
+        i = bisect.bisect_right(self.sequences, last_sequence, lo=self.start)
+        return self.events[i:]
+
+    def all(self) -> List[Event]:
+        return self.events[self.start:]
+
+
+def _size(event: Event) -> int:
+    return len(event.to_json()) + _EVENT_OVERHEAD
+
+
+class MemoryEventBuffer:
+    def __init__(
+        self,
+        ttl_seconds: int = 300,
+        capacity: int = RING_CAPACITY,
+        max_bytes: int = MAX_BYTES,
+        archive: Optional[EventArchive] = None,
+    ):
+        self.ttl = ttl_seconds
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        # least recently used first
+        self.rings: "OrderedDict[str, EventRing]" = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+
+        if archive is None and ARCHIVE_PATH:
+            archive = EventArchive()
+        self.archive = archive
+
+    def warm_up(self, connections: int = 4) -> int:
+        """Nothing to connect to."""
+        return 0
+
+    def append(self, conversation_id: str, sequence: int, event: Event | Dict) -> None:
+        """
+        Append an event to the conversation's ring.
+
+        Refreshes the conversation's TTL and LRU position.
+        """
+        if not isinstance(event, Event):
+            event = Event.from_json(json.dumps(event))
+
+        ring = self.rings.get(conversation_id)
+        if ring is None:
+            ring = self.rings[conversation_id] = EventRing(self.capacity)
+        else:
+            self.rings.move_to_end(conversation_id)
+        ring.touched = time.monotonic()
+
+        size = _size(event)
+        self.bytes += size - ring.append(event, size)
+        if self.bytes > self.max_bytes:
+            self._evict(keep=conversation_id)
+
+        if event.type == "done":
+            self.archive_later(conversation_id, ring)
+
+    def archive_conversation(self, conversation_id: str) -> int:
+        """Copy the ring's events not yet archived into the cold archive (blocking)."""
+        ring = self.rings.get(conversation_id)
+        if self.archive is None or ring is None:
+            return 0
+        return self.archive.store(conversation_id, [(ev.sequence, ev.to_json()) for ev in ring.since(ring.archived)])
+
+    def archive_later(self, conversation_id: str, ring: EventRing) -> None:
+        """Archive the ring's new events in the I/O pool, after any earlier pass of the conversation."""
+        if self.archive is None:
+            return
+
+        async def _pass():
+            # taken when the pass starts, so it includes whatever earlier passes did not
+            events = ring.since(ring.archived)
+            if not events:
+                return
+            await run_io(self.archive.store, conversation_id, [(ev.sequence, ev.to_json()) for ev in events])
+            ring.archived = max(ring.archived, events[-1].sequence)
+
+        self.archive.schedule(conversation_id, _pass)
+
+    def _drop(self, conversation_id: str) -> None:
+        ring = self.rings.pop(conversation_id)
+        self.bytes -= ring.bytes
+        # the pass keeps the dropped ring alive until its events are stored
+        self.archive_later(conversation_id, ring)
+
+    def _evict(self, keep: str) -> None:
+        """Drop least recently used conversations until under the memory cap."""
+        while self.bytes > self.max_bytes and len(self.rings) > 1:
+            conversation_id = next(iter(self.rings))
+            if conversation_id == keep:
+                self.rings.move_to_end(keep)
+                continue
+            self._drop(conversation_id)
+            self.evictions += 1
+
+    def replay(self, conversation_id: str, last_sequence: int) -> List[Dict]:
+        """
+        Replay buffered events with sequence > last_sequence.
+        Used by the 'resume' client event.
+        """
+        return [ev.to_dict() for ev in self.replay_events(conversation_id, last_sequence)]
+
+    def replay_events(self, conversation_id: str, last_sequence: int) -> List[Event]:
+        """
+        Like `replay`, but returns the buffered `Event` records themselves.
+
+        Events that were already evicted are read from the archive.
+        """
+        ring = self.rings.get(conversation_id)
+        events = ring.since(last_sequence) if ring is not None else []
+        if self.archive is None:
+            return events
+        return self.archive.backfill(conversation_id, last_sequence, events)
+
+    async def load_replay(self, conversation_id: str, last_sequence: int) -> List[Event]:
+        """`replay_events`, reading the archive in the I/O pool when the ring does not cover the gap."""
+        ring = self.rings.get(conversation_id)
+        events = ring.since(last_sequence) if ring is not None else []
+        if self.archive is None or (events and events[0].sequence == last_sequence + 1):
+            return events
+        return await run_io(self.archive.backfill, conversation_id, last_sequence, events)
+
+    async def load_last_sequence(self, conversation_id: str) -> int:
+        """Highest sequence kept for the conversation, in the ring or the archive."""
+        ring = self.rings.get(conversation_id)
+        if ring is not None and len(ring):
+            return ring.sequences[-1]
+        if self.archive is None:
+            return 0
+        return await run_io(self.archive.last_sequence, conversation_id)
+
+    def replay_tail(self, conversation_id: str, last_sequence: int, count: int) -> List[Event]:
+        ring = self.rings.get(conversation_id)
+        return ring.since(last_sequence) if ring is not None else []
+
+    def flush(self) -> int:
+        """
+        Archive every conversation (called on shutdown, so a restarted
+        worker can replay them). Returns the number that could not be kept.
+        """
+        if self.archive is None:
+            return len(self.rings)
+        lost = 0
+        for conversation_id in list(self.rings):
+            try:
+                self.archive_conversation(conversation_id)
+            except Exception as e:
+                lost += 1
+                print(f"[BUFFER] archiving {conversation_id} failed: {e}")
+        return lost
+
+    def snapshot(self) -> Dict:
+        return {
+            "backend": "memory",
+            "conversations": len(self.rings),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+    def cleanup(self) -> None:
+        """Expire conversations idle longer than the TTL and prune the archive."""
+        cutoff = time.monotonic() - self.ttl
+        # LRU order: the first fresh conversation ends the scan
+        while self.rings:
+            conversation_id, ring = next(iter(self.rings.items()))
+            if ring.touched > cutoff:
+                break
+            self._drop(conversation_id)
+
+        if self.archive is not None:
+            self.archive.prune_later()
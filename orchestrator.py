@@ -4,23 +4,41 @@ Integration uses VBChatbot (LangGraph) which yields streamed chunks and interrup
 We buffer small chunks into larger text tokens for UI friendliness.
 """
 
+import asyncio
 import os
 import sys
-from pathlib import Path
+import time
+from contextlib import aclosing
+from enum import Enum
+from typing import TYPE_CHECKING, Dict, Optional, Any
+
+from admission import AdmissionController, PRIORITY_ACTION, PRIORITY_MESSAGE
+from events import new_event, now_ts_ms
+from idempotency import InboundDedup
+from inbound import Mailbox
+from overload import OverloadGuard, overload_error
+from schemas import ActionEnvelope, InboundEnvelope, UserMessageEnvelope
+from buffer import EventBuffer
+from connection import ClientConnection
+from services.utils.cancellation import CancelMetrics, CancelScope
+from services.utils.tracing import Turn, tracer
 
-# Add the services directory to the path for importing
-current_dir = Path(__file__).parent
-services_dir = current_dir / 'services'
-sys.path.insert(0, str(services_dir))
+if TYPE_CHECKING:
+    from services.agent import VBChatbot
 
-from services.agent import VBChatbot
 
-import asyncio
-from enum import Enum
-from typing import Dict, Optional, Any
+# How long a cancel waits for the old run to unwind before moving on
+CANCEL_WAIT_SECONDS = 2.0
 
-from events import make_event
-from buffer import EventBuffer
+# What to do with a generation nobody is watching any more: "cancel" it once
+# the grace period has passed (buffered events stay available for resume)
+# or "continue" to the end
+ORPHAN_POLICY = os.getenv("ORPHAN_POLICY", "cancel")
+ORPHAN_GRACE_SECONDS = float(os.getenv("ORPHAN_GRACE_SECONDS", "30"))
+
+# Conversations nobody has touched for this long are forgotten, with their
+# graph checkpoints (matches the archive retention: resume is gone by then)
+CONVERSATION_IDLE_SECONDS = float(os.getenv("CONVERSATION_IDLE_SECONDS", "21600"))
 
 
 class State(str, Enum):
@@ -36,42 +54,149 @@ class State(str, Enum):
 
 
 class Conversation:
+    # tens of thousands of idle-but-resumable conversations live per worker,
+    # so no per-instance __dict__
+    __slots__ = (
+        "id", "state", "sequence", "current_task", "cancel_scope", "vb",
+        "subscribers", "mailbox", "trace", "user_id", "user_info", "touched",
+    )
+
     def __init__(self, conversation_id: str):
         self.id = conversation_id
         self.state: State = State.Idle
         self.sequence = 0
-        self.sent_event_ids: set[str] = set()
         self.current_task: Optional[asyncio.Task] = None
-        self.vb: Optional[VBChatbot] = None
+        self.cancel_scope: Optional[CancelScope] = None
+        self.vb: Optional["VBChatbot"] = None
+        # connections currently watching this conversation (allocated on first subscribe)
+        self.subscribers: Optional[set[ClientConnection]] = None
+        # inbound user_message/action events (allocated on first use)
+        self.mailbox: Optional[Mailbox] = None
+        # sampled trace of the current turn (None when not sampled)
+        self.trace: Optional[Turn] = None
 
         # --- added: identity/context ---
         self.user_id: Optional[str] = None
         self.user_info: Dict[str, Any] = {}
+        # last client event or emitted event (ms), for idle eviction
+        self.touched = now_ts_ms()
 
 
 class Orchestrator:
-    def __init__(self, buffer: EventBuffer):
+    def __init__(
+        self,
+        buffer: EventBuffer,
+        admission: Optional[AdmissionController] = None,
+        overload: Optional[OverloadGuard] = None,
+        dedup: Optional[InboundDedup] = None,
+    ):
         self.buffer = buffer
+        self.admission = admission or AdmissionController.from_env()
+        self.overload = overload or OverloadGuard.from_env()
+        self.dedup = dedup or InboundDedup.from_env()
+        self.cancel_metrics = CancelMetrics()
+        self.orphans_cancelled = 0
+        self.conversations_evicted = 0
+        self._chatbot: Optional["VBChatbot"] = None
+        # checkpoints handed over by the previous worker, loaded with the chatbot
+        self._restored_checkpoints: Optional[Dict[str, Any]] = None
         self.conversations: Dict[str, Conversation] = {}
-        self._locks: Dict[str, asyncio.Lock] = {}
+        # set on shutdown: finish what runs, start nothing new
+        self.draining = False
+
+    def chatbot(self) -> "VBChatbot":
+        """The worker's VBChatbot, shared by all conversations.
+
+        Threads are isolated by thread_id in its checkpointer, so one instance
+        (one compiled graph, one set of model clients) serves every conversation.
+        The LangGraph/LangChain/OpenAI stack is imported on first use (or by the
+        startup warm-up), not when this module is loaded.
+        """
+        if self._chatbot is None:
+            from services.agent import VBChatbot
+
+            self.install_chatbot(VBChatbot())
+        return self._chatbot
+
+    def install_chatbot(self, vb: "VBChatbot") -> "VBChatbot":
+        """Make `vb` the worker's chatbot unless one is already in use.
+
+        Call on the event loop. The warm-up builds its instance in a thread
+        and installs it here, so a conversation that arrived in the meantime
+        keeps the chatbot (and checkpointer) it already uses.
+        """
+        if self._chatbot is None:
+            self._chatbot = vb
+            if self._restored_checkpoints is not None:
+                threads = vb.import_checkpoints(self._restored_checkpoints)
+                self._restored_checkpoints = None
+                print(f"Restored checkpoints of {threads} threads")
+        return self._chatbot
 
     def _ensure_conv(self, conversation_id: str) -> Conversation:
-        if conversation_id not in self.conversations:
-            self.conversations[conversation_id] = Conversation(conversation_id)
-            self._locks[conversation_id] = asyncio.Lock()
-        return self.conversations[conversation_id]
+        conv = self.conversations.get(conversation_id)
+        if conv is None:
+            # interned so the dict key, conv.id and every Event share one string
+            conversation_id = sys.intern(conversation_id)
+            conv = Conversation(conversation_id)
+            self.conversations[conversation_id] = conv
+        else:
+            conv.touched = now_ts_ms()
+        return conv
+
+    async def _open_conv(self, conversation_id: str) -> Conversation:
+        """`_ensure_conv` for client events.
+
+        A conversation evicted while idle may still have its log in the
+        buffer or archive; its new record continues after that log's last
+        sequence, so replay never mixes two logs under the same numbers.
+        """
+        conv = self.conversations.get(conversation_id)
+        if conv is not None:
+            conv.touched = now_ts_ms()
+            return conv
+        last = await self.buffer.load_last_sequence(conversation_id)
+        # another event may have created it while the lookup ran
+        conv = self._ensure_conv(conversation_id)
+        conv.sequence = max(conv.sequence, last)
+        return conv
+
+    def _is_idle(self, conv: Conversation, cutoff_ms: int) -> bool:
+        return (
+            conv.touched < cutoff_ms
+            and not conv.subscribers
+            and (conv.current_task is None or conv.current_task.done())
+            and (conv.mailbox is None or not conv.mailbox.items)
+        )
+
+    def evict_idle(self, idle_seconds: float = CONVERSATION_IDLE_SECONDS) -> int:
+        """Forget conversations idle longer than `idle_seconds`, with their graph threads.
+
+        Called from the cleanup loop. Conversations with a subscriber, a
+        running generation or queued input are kept however old they are.
+        """
+        cutoff = now_ts_ms() - int(idle_seconds * 1000)
+        idle = [conv for conv in self.conversations.values() if self._is_idle(conv, cutoff)]
+        for conv in idle:
+            del self.conversations[conv.id]
+            if conv.mailbox is not None:
+                conv.mailbox.close()
+                conv.mailbox = None
+            conv.vb = None
+        if idle and self._chatbot is not None:
+            self._chatbot.forget_threads([conv.id for conv in idle])
+        self.conversations_evicted += len(idle)
+        return len(idle)
 
     # --- added: extract user_id/user_info from envelope ---
-    def _extract_user_ctx(self, envelope: Dict[str, Any]) -> Dict[str, Any]:
-        payload = envelope.get("payload", {}) or {}
+    def _extract_user_ctx(self, envelope: InboundEnvelope) -> Dict[str, Any]:
+        payload = envelope.payload
         print("extracting user context from envelope:", envelope)
-        user_info = payload.get("user_info") or envelope.get("user_info") or {}
-        if not isinstance(user_info, dict):
-            user_info = {}
+        user_info = payload.user_info or envelope.user_info or {}
 
         user_id = (
-            envelope.get("user_id")
-            or payload.get("user_id")
+            envelope.user_id
+            or payload.user_id
             or user_info.get("user_id")
         )
         if user_id is not None:
@@ -84,117 +209,318 @@ class Orchestrator:
 
         return {"user_id": user_id, "user_info": user_info}
 
-    async def handle_incoming(self, websocket, envelope: Dict[str, Any]):
-        t = envelope.get("type")
-        conv_id = envelope.get("conversation_id")
-        if not t or not conv_id:
-            await self._safe_send_json(websocket, {"type": "error", "payload": {"message": "missing type or conversation_id"}})
+    # -------- subscriptions --------
+
+    def subscribe(self, conn: ClientConnection, conv: Conversation, credits: Optional[int] = None):
+        conn.subscribe(conv.id, credits)
+        if conv.subscribers is None:
+            conv.subscribers = set()
+        conv.subscribers.add(conn)
+
+    def _has_watchers(self, conv: Conversation) -> bool:
+        return any(not conn.closed for conn in conv.subscribers or ())
+
+    def _watch_orphan(self, conv: Conversation):
+        """If a running generation has lost all subscribers, re-check after the grace period."""
+        task = conv.current_task
+        if ORPHAN_POLICY != "cancel" or task is None or task.done() or self._has_watchers(conv):
             return
+        asyncio.get_running_loop().call_later(ORPHAN_GRACE_SECONDS, self._reap_orphan, conv, task)
 
-        conv = self._ensure_conv(conv_id)
+    def _reap_orphan(self, conv: Conversation, task: asyncio.Task):
+        if task.done() or conv.current_task is not task or self._has_watchers(conv):
+            return
+        print(f"[ORPHAN] nobody watching {conv.id} for {ORPHAN_GRACE_SECONDS}s, cancelling generation")
+        self.orphans_cancelled += 1
+        asyncio.create_task(self._cancel_run(conv, "orphaned"))
+
+    def unsubscribe(self, conn: ClientConnection, conv: Conversation):
+        conn.unsubscribe(conv.id)
+        if conv.subscribers:
+            conv.subscribers.discard(conn)
+        self._watch_orphan(conv)
+
+    def detach(self, conn: ClientConnection):
+        """Forget a closed connection.
+
+        Running generations keep buffering for resume; one left without any
+        subscriber is cancelled after the orphan grace period (ORPHAN_POLICY).
+        """
+        for conv_id in list(conn.channels):
+            conv = self.conversations.get(conv_id)
+            if conv is not None and conv.subscribers:
+                conv.subscribers.discard(conn)
+                self._watch_orphan(conv)
+
+    async def attach(self, conn: ClientConnection, conversation_id: str, last_sequence: Optional[int] = None) -> Conversation:
+        """Subscribe `conn` to a conversation, replaying after `last_sequence` if given."""
+        conv = await self._open_conv(conversation_id)
+        self.subscribe(conn, conv)
+        if last_sequence is not None:
+            await self._replay_to(conn, conv, last_sequence)
+        return conv
+
+    async def handle_incoming(self, conn: Optional[ClientConnection], envelope: InboundEnvelope):
+        """Handle one decoded client event (see `schemas.decode_envelope`).
+
+        `conn` is None for events posted over plain HTTP (see `POST /chat`):
+        they act on the conversation, and output reaches whoever is subscribed.
+        """
+        t = envelope.type
+        conv = await self._open_conv(envelope.conversation_id)
+
+        if t == "subscribe":
+            await self._handle_subscribe(conn, conv, envelope)
+            return
+        if t == "unsubscribe":
+            self.unsubscribe(conn, conv)
+            return
+        if t == "credit":
+            self._handle_credit(conn, conv, envelope)
+            return
+
+        # any other event implicitly subscribes the sender to the conversation
+        if conn is not None and not conn.is_subscribed(conv.id):
+            self.subscribe(conn, conv)
 
         # --- added: update conv user context when provided ---
         ctx = self._extract_user_ctx(envelope)
         if ctx.get("user_id"):
-            conv.user_id = ctx["user_id"]
+            conv.user_id = sys.intern(ctx["user_id"])
         if ctx.get("user_info"):
             conv.user_info = ctx["user_info"]
 
         if t == "resume":
-            await self._handle_resume(websocket, conv, envelope)
+            await self._handle_resume(conn, conv, envelope)
+            return
+        if t in ("user_message", "action") and self.draining:
+            if conn is not None:
+                conn.send_control({
+                    "type": "error",
+                    "conversation_id": conv.id,
+                    "payload": overload_error("draining", "server is restarting, reconnect and retry", self.overload.retry_after_ms),
+                })
             return
-        if t == "user_message":
-            await self._handle_user_message(websocket, conv, envelope)
+        if t in ("user_message", "action") and await self._reattach_duplicate(conn, conv, envelope):
             return
-        if t == "action":
-            await self._handle_action(websocket, conv, envelope)
+        if t in ("user_message", "action"):
+            await self._post(conn, conv, envelope)
             return
         if t == "stop":
-            await self._handle_stop(websocket, conv, envelope)
+            await self._handle_stop(conn, conv, envelope)
             return
 
-        await self._emit(websocket, conv, "error", {"message": f"unknown client event type {t}"})
+    async def _handle_subscribe(self, conn: ClientConnection, conv: Conversation, envelope: InboundEnvelope):
+        payload = envelope.payload
+        self.subscribe(conn, conv, payload.credits)
 
-    async def _handle_resume(self, websocket, conv: Conversation, envelope: Dict[str, Any]):
-        payload = envelope.get("payload", {})
-        last_sequence = payload.get("last_sequence")
-        if last_sequence is None:
-            await self._emit(websocket, conv, "error", {"message": "resume missing last_sequence"})
-            return
+        # optional catch-up in the same round trip
+        if payload.last_sequence is not None:
+            await self._replay_to(conn, conv, payload.last_sequence)
 
-        events = self.buffer.replay(conv.id, int(last_sequence))
-        for ev in sorted(events, key=lambda e: e.get("sequence", 0)):
-            eid = ev.get("event_id")
-            if eid and eid in conv.sent_event_ids:
-                continue
-            ok = await self._safe_send_json(websocket, ev)
-            if not ok:
-                return
-            if eid:
-                conv.sent_event_ids.add(eid)
+    def _handle_credit(self, conn: ClientConnection, conv: Conversation, envelope: InboundEnvelope):
+        if envelope.payload.credits > 0:
+            conn.grant(conv.id, envelope.payload.credits)
 
-    async def _handle_user_message(self, websocket, conv: Conversation, envelope: Dict[str, Any]):
-        payload = envelope.get("payload", {})
-        text = payload.get("text", "")
+    async def _replay_to(self, conn: ClientConnection, conv: Conversation, last_sequence: int):
+        # loading (Redis, archive, decode) runs in the I/O pool; live events
+        # emitted meanwhile are held back and sent by the tail read below
+        load_from = conv.sequence
+        ch = conn.hold(conv.id)
+        try:
+            events = await self.buffer.load_replay(conv.id, last_sequence)
+        finally:
+            conn.release(ch)
+
+        # no awaits between rewind and enqueue, so live events cannot interleave
+        conn.rewind(conv.id, last_sequence)
+        upto = last_sequence
+        for ev in sorted(events, key=lambda e: e.sequence):
+            if not conn.send(ev):
+                return
+            upto = ev.sequence
+        if conv.sequence > max(upto, load_from):
+            # emitted while the replay was loading (held back above)
+            for ev in self.buffer.replay_tail(conv.id, upto, conv.sequence - load_from):
+                if not conn.send(ev):
+                    return
 
-        conv.state = State.Analyzing
-        await self._emit(websocket, conv, "status", {"status": "analyzing"})
+    async def _reattach_duplicate(self, conn: ClientConnection, conv: Conversation, envelope: InboundEnvelope) -> bool:
+        """Answer a retried message by replaying its run instead of starting another one."""
+        event_id = envelope.event_id
+        if not event_id:
+            return False
+        start_sequence = await self.dedup.claim(conv.id, event_id, conv.sequence)
+        if start_sequence is None:
+            return False
+        print(f"[IDEMPOTENCY] duplicate {event_id} on {conv.id}, replaying from {start_sequence}")
+        if conn is not None:
+            await self._replay_to(conn, conv, start_sequence)
+        return True
+
+    async def _post(self, conn: ClientConnection, conv: Conversation, envelope: InboundEnvelope):
+        """Hand a work-starting event to the conversation's mailbox worker."""
+        if conv.mailbox is None:
+            conv.mailbox = Mailbox(
+                lambda c, e, posted_ns: self._process_inbound(c, conv, e, posted_ns),
+                busy=lambda: conv.current_task is not None and not conv.current_task.done(),
+                wait_idle=lambda: asyncio.wait({conv.current_task}),
+            )
+        if not conv.mailbox.post(conn, envelope):
+            await self.dedup.forget(conv.id, envelope.event_id)
+            await self._emit(conv, "error", overload_error(
+                "mailbox_full", "too many pending messages for this conversation", self.overload.retry_after_ms,
+            ))
+
+    async def _process_inbound(self, conn: ClientConnection, conv: Conversation, envelope: InboundEnvelope, posted_ns: int):
+        # queue/coalesce: the mailbox has waited for the running turn to finish
+        tracer.end_turn(conv.trace)
+        conv.trace = tracer.start_turn(conv.id, f"turn:{envelope.type}", posted_ns, event_id=envelope.event_id or "")
+        if conv.trace is not None:
+            conv.trace.record("mailbox_wait", posted_ns, time.time_ns())
+
+        task = conv.current_task
+        if envelope.type == "user_message":
+            await self._handle_user_message(conn, conv, envelope)
+        else:
+            await self._handle_action(conn, conv, envelope)
+
+        # rejected before a run started: nothing else will end the turn
+        if conv.current_task is task:
+            tracer.end_turn(conv.trace)
+            conv.trace = None
+
+    async def _handle_resume(self, conn: ClientConnection, conv: Conversation, envelope: InboundEnvelope):
+        await self._replay_to(conn, conv, envelope.payload.last_sequence)
+
+    async def _handle_user_message(self, conn: ClientConnection, conv: Conversation, envelope: UserMessageEnvelope):
+        text = envelope.payload.text
+
+        retry_after = self.overload.admit_generation()
+        if retry_after is not None:
+            await self.dedup.forget(conv.id, envelope.event_id)
+            await self._emit(conv, "error", overload_error("overloaded", "too many generations in flight, retry later", retry_after))
+            return
 
         # cancel previous task (กรณีผู้ใช้พิมพ์ใหม่ระหว่างกำลัง generate)
-        if conv.current_task and not conv.current_task.done():
-            conv.current_task.cancel()
+        # and wait for it to unwind so two generations never overlap
+        await self._cancel_run(conv, "superseded")
 
-        # create chatbot instance for this conversation (kept for resume)
+        conv.state = State.Analyzing
+        await self._emit(conv, "status", {"status": "analyzing"})
+
+        # attach the worker's chatbot (its checkpointer keeps the thread for resume)
         if conv.vb is None:
-            conv.vb = VBChatbot()
+            conv.vb = self.chatbot()
 
-        conv.state = State.Generating
-        conv.current_task = asyncio.create_task(
-            self._run_vb_stream(
-                websocket=websocket,
-                conv=conv,
-                message=text,
-                resume=False,
-                user_info=conv.user_info,   # --- changed: pass user_info from conv ---
-            )
-        )
+        self._start_run(conv, text, resume=False)
 
-    async def _handle_action(self, websocket, conv: Conversation, envelope: Dict[str, Any]):
+    async def _handle_action(self, conn: ClientConnection, conv: Conversation, envelope: ActionEnvelope):
         if conv.state != State.WaitingAction:
-            await self._emit(websocket, conv, "error", {"message": "no action expected in current state"})
+            await self.dedup.forget(conv.id, envelope.event_id)
+            await self._emit(conv, "error", {"message": "no action expected in current state"})
             return
 
-        payload = envelope.get("payload", {})
-        action_id = payload.get("id") or payload.get("action") or payload.get("action_id") or ""
-        action_id = str(action_id)
+        action_id = envelope.payload.action_id
         print(f"Received action: {action_id}")
 
         conv.state = State.ProcessingAction
-        await self._emit(websocket, conv, "status", {"status": "processing_action"})
+        await self._emit(conv, "status", {"status": "processing_action"})
 
         # *** ไม่ต้อง cancel task เดิม ***
         # เพราะตอน interrupt เรา return ออกจาก _run_vb_stream แล้ว task เดิมจบไปแล้ว
 
         if conv.vb is None:
-            conv.vb = VBChatbot()
+            conv.vb = self.chatbot()
+
+        self._start_run(conv, action_id, resume=True)
+
+    async def _handle_stop(self, conn: ClientConnection, conv: Conversation, envelope: InboundEnvelope):
+        if conv.mailbox is not None:
+            conv.mailbox.clear()
+        await self._cancel_run(conv, "stopped")
+        conv.state = State.Completed
+        await self._emit(conv, "done", {"message": "stopped"})
+
+    # -------- Shutdown hand-off --------
+
+    def running_tasks(self) -> list[asyncio.Task]:
+        return [
+            conv.current_task for conv in self.conversations.values()
+            if conv.current_task is not None and not conv.current_task.done()
+        ]
+
+    def notify_reconnect(self) -> int:
+        """Tell every subscriber to reconnect and `resume` (not buffered: it is not part of the conversation)."""
+        notified = 0
+        for conv in self.conversations.values():
+            for conn in conv.subscribers or ():
+                if conn.closed:
+                    continue
+                conn.send_control({
+                    "type": "status",
+                    "conversation_id": conv.id,
+                    "payload": {"status": "reconnect", "resume": True, "last_sequence": conv.sequence},
+                })
+                notified += 1
+        return notified
+
+    def export_state(self) -> Dict[str, Any]:
+        """Conversation records and graph checkpoints for the next worker."""
+        checkpoints = self._chatbot.export_checkpoints() if self._chatbot is not None else self._restored_checkpoints
+        return {
+            "conversations": [
+                (conv.id, conv.state.value, conv.sequence, conv.user_id, conv.user_info)
+                for conv in self.conversations.values()
+            ],
+            "checkpoints": checkpoints,
+        }
 
+    def import_state(self, state: Dict[str, Any]) -> int:
+        for conv_id, conv_state, sequence, user_id, user_info in state.get("conversations", ()):
+            conv = self._ensure_conv(conv_id)
+            # keep numbering where the previous worker stopped so resume stays consistent
+            conv.sequence = max(conv.sequence, sequence)
+            # runs did not survive the restart; pending cards did (their checkpoint is restored)
+            conv.state = State(conv_state) if conv_state == State.WaitingAction.value else State.Completed
+            conv.user_id = sys.intern(user_id) if user_id else None
+            conv.user_info = user_info or {}
+        if state.get("checkpoints"):
+            if self._chatbot is not None:
+                self._chatbot.import_checkpoints(state["checkpoints"])
+            else:
+                self._restored_checkpoints = state["checkpoints"]
+        return len(state.get("conversations", ()))
+
+    # -------- Run lifecycle --------
+
+    def _start_run(self, conv: Conversation, message: str, resume: bool):
         conv.state = State.Generating
+        conv.cancel_scope = CancelScope()
         conv.current_task = asyncio.create_task(
             self._run_vb_stream(
-                websocket=websocket,
                 conv=conv,
-                message=action_id,
-                resume=True,
+                message=message,
+                resume=resume,
                 user_info=conv.user_info,   # --- changed: pass user_info from conv ---
             )
         )
+        # started over HTTP with no stream attached yet
+        self._watch_orphan(conv)
 
-    async def _handle_stop(self, websocket, conv: Conversation, envelope: Dict[str, Any]):
-        if conv.current_task and not conv.current_task.done():
-            conv.current_task.cancel()
-            await asyncio.sleep(0)
-        conv.state = State.Completed
-        await self._emit(websocket, conv, "done", {"message": "stopped"})
+    async def _cancel_run(self, conv: Conversation, reason: str):
+        """Cancel the running generation and wait (bounded) until it has unwound.
+
+        The scope tells in-flight model calls to abort their HTTP request right
+        away; task.cancel() covers code that is not scope-aware.
+        """
+        task = conv.current_task
+        if task is None or task.done():
+            return
+        if conv.cancel_scope is not None:
+            conv.cancel_scope.cancel(reason)
+        task.cancel()
+        await asyncio.wait({task}, timeout=CANCEL_WAIT_SECONDS)
 
     # -------- VBChatbot integration --------
 
@@ -215,10 +541,14 @@ class Orchestrator:
         return s.replace("\r\n", "").replace("\r", "")
 
     # --- changed: accept user_info param ---
-    async def _run_vb_stream(self, websocket, conv: Conversation, message: str, resume: bool = False, user_info: Optional[Dict[str, Any]] = None):
+    async def _run_vb_stream(self, conv: Conversation, message: str, resume: bool = False, user_info: Optional[Dict[str, Any]] = None):
         buffer_text = ""
+        streamed_chars = 0
+        started = time.monotonic()
+        trace = conv.trace
+        self.overload.generations += 1
         try:
-            vb = conv.vb or VBChatbot()
+            vb = conv.vb or self.chatbot()
             conv.vb = vb
 
             # fallback user_id if none provided (keeps old demo behavior but not hardcoded only)
@@ -232,108 +562,149 @@ class Orchestrator:
                 ui = dict(ui)
                 ui["user_id"] = "demo-user-222xxx"
 
-            async for chunk in vb.run(
+            # wait for a model slot; action resumes jump ahead of new messages
+            async def _report_position(position: int):
+                await self._emit(conv, "status", {"status": "queued", "position": position})
+
+            async with self.admission.slot(
+                ui["user_id"],
+                priority=PRIORITY_ACTION if resume else PRIORITY_MESSAGE,
+                on_position=_report_position,
+            ), aclosing(vb.run(
                 thread_id=conv.id,
                 message=message,
                 resume=resume,
                 user_info=ui,  # --- changed: use ui from client/conv ---
-            ):
-                if conv.state != State.Generating:
-                    break
-
-                # INTERRUPT
-                if isinstance(chunk, tuple) and len(chunk) >= 2 and chunk[0] == "Interrupt:":
-                    question = str(chunk[1])
-                    print(f"Orchestrator: interrupt detected, asking for confirmation: {chunk}")
-
-                    if buffer_text.strip():
-                        await self._emit(websocket, conv, "token", {"text": buffer_text})
-                        buffer_text = ""
-
-                    await self._emit(websocket, conv, "card", self._build_confirm_card(question))
-                    conv.state = State.WaitingAction
-                    await self._emit(websocket, conv, "status", {"status": "waiting_action"})
-                    return
-
-                # TEXT
-                if isinstance(chunk, str) and chunk:
-                    buffer_text += self._normalize_chunk(chunk)
-                    if self._should_flush(buffer_text):
-                        await self._emit(websocket, conv, "token", {"text": buffer_text})
-                        buffer_text = ""
-                    continue
-
-                # DICT
-                if isinstance(chunk, dict):
-                    print(chunk.get("case_progress"))
-                    if buffer_text.strip():
-                        await self._emit(websocket, conv, "token", {"text": buffer_text})
-                        buffer_text = ""
-
-                    et = chunk.get("type")
-                    pl = chunk.get("payload", chunk)
-                    # LangGraph streaming adapter: treat {"stream": "..."} as token
-                    if chunk.get("case_progress"):
-                        await self._emit(websocket, conv, "caseProgress", self._build_case_progress())
-                        print(f"Orchestrator: case progress update: {chunk}")
+                cancel_scope=conv.cancel_scope,
+                trace=trace,
+            )) as stream:
+                if trace is not None:
+                    trace.mark("admitted")
+                first_chunk = True
+                async for chunk in stream:
+                    if conv.state != State.Generating:
+                        break
+                    if first_chunk and trace is not None:
+                        trace.mark("first_chunk")
+                    first_chunk = False
+
+                    # INTERRUPT
+                    if isinstance(chunk, tuple) and len(chunk) >= 2 and chunk[0] == "Interrupt:":
+                        question = str(chunk[1])
+                        print(f"Orchestrator: interrupt detected, asking for confirmation: {chunk}")
+
+                        if buffer_text.strip():
+                            await self._emit(conv, "token", {"text": buffer_text})
+                            buffer_text = ""
+
+                        await self._emit(conv, "card", self._build_confirm_card(question))
+                        conv.state = State.WaitingAction
+                        await self._emit(conv, "status", {"status": "waiting_action"})
+                        return
+
+                    # node token stream: {"stream": ..., "node": ..., "index": ...}
+                    # is plain text and goes through the same batching as str chunks
+                    if isinstance(chunk, dict) and "stream" in chunk and not chunk.get("type"):
+                        chunk = chunk["stream"]
+
+                    # TEXT
+                    if isinstance(chunk, str) and chunk:
+                        streamed_chars += len(chunk)
+                        buffer_text += self._normalize_chunk(chunk)
+                        if self._should_flush(buffer_text):
+                            await self._emit(conv, "token", {"text": buffer_text})
+                            buffer_text = ""
                         continue
-                    if not et and "stream" in chunk:
-                        await self._emit(websocket, conv, "token", {"text": chunk["stream"]})
+
+                    # DICT
+                    if isinstance(chunk, dict):
+                        print(chunk.get("case_progress"))
+                        if buffer_text.strip():
+                            await self._emit(conv, "token", {"text": buffer_text})
+                            buffer_text = ""
+
+                        et = chunk.get("type")
+                        pl = chunk.get("payload", chunk)
+                        if chunk.get("case_progress"):
+                            await self._emit(conv, "caseProgress", self._build_case_progress())
+                            print(f"Orchestrator: case progress update: {chunk}")
+                            continue
+                        if et in ("status", "card", "token", "done", "error"):
+                            await self._emit(conv, et, pl)
+                        else:
+                            await self._emit(conv, "status", {"status": "update", "data": chunk})
                         continue
-                    if et in ("status", "card", "token", "done", "error"):
-                        await self._emit(websocket, conv, et, pl)
-                    else:
-                        await self._emit(websocket, conv, "status", {"status": "update", "data": chunk})
-                    continue
-                # Confrim
-                # print(chunk.get("case_progress"))
+                    # Confrim
+                    # print(chunk.get("case_progress"))
         
-            if buffer_text.strip():
-                await self._emit(websocket, conv, "token", {"text": buffer_text})
+                if buffer_text.strip():
+                    await self._emit(conv, "token", {"text": buffer_text})
 
             conv.state = State.Completed
             # print(f"Conversation {resume} completed.")
             
             
-            await self._emit(websocket, conv, "done", {"message": "completed" if not resume else "action_processed"})
+            await self._emit(conv, "done", {"message": "completed" if not resume else "action_processed"})
+
+            # fold old turns into the rolling summary now that the reply is out
+            vb.schedule_summary(conv.id)
 
         except asyncio.CancelledError:
             conv.state = State.Completed
-            await self._emit(websocket, conv, "status", {"status": "stopped"})
+            scope = conv.cancel_scope
+            requested = scope.requested_at if scope and scope.requested_at else started
+            self.cancel_metrics.record(
+                scope.reason if scope and scope.reason else "cancelled",
+                time.monotonic() - requested,
+                streamed_chars // 4,  # rough: tokens generated upstream that nobody will read
+            )
+            await self._emit(conv, "status", {"status": "stopped"})
         except Exception as e:
             conv.state = State.Error
-            await self._emit(websocket, conv, "error", {"message": str(e)})
-
-    # -------- Safe emit / buffer --------
-
-    async def _safe_send_json(self, websocket, payload: Dict[str, Any]) -> bool:
-        """Send json but never crash the whole websocket handler."""
-        try:
-            await websocket.send_json(payload)
-            return True
-        except Exception:
-            # ถ้า client หลุดไปแล้ว จะส่งไม่ได้ -> อย่าให้ล้ม
-            return False
-
-    async def _emit(self, websocket, conv: Conversation, event_type: str, payload: Dict[str, Any]):
-        async with self._locks[conv.id]:
-            conv.sequence += 1
-            seq = conv.sequence
-            ev = make_event(event_type, conv.id, seq, payload)
-
-            # --- added: attach user_id at event top-level so client sees it ---
-            if conv.user_id:
-                ev["user_id"] = conv.user_id
-
-            ok = await self._safe_send_json(websocket, ev)
-            if not ok:
-                return
-
+            await self._emit(conv, "error", {"message": str(e)})
+        finally:
+            self.overload.generations -= 1
+            if trace is not None:
+                trace.attrs["streamed_chars"] = streamed_chars
+                tracer.end_turn(trace)
+                if conv.trace is trace:
+                    conv.trace = None
+
+    # -------- Emit / buffer --------
+
+    async def _emit(self, conv: Conversation, event_type: str, payload: Dict[str, Any]):
+        """Sequence an event, buffer it for resume and fan it out to subscribers.
+
+        Delivery is queued on each subscribed connection; the connection's
+        writer applies flow control, so this never blocks on a slow socket.
+
+        There is no await between taking the sequence number and fanning out,
+        so events of a conversation are buffered and queued in sequence order
+        without a per-conversation lock. Keep it that way.
+        """
+        conv.sequence += 1
+        seq = conv.sequence
+        # --- added: attach user_id at event top-level so client sees it ---
+        ev = new_event(event_type, conv.id, seq, payload, conv.user_id)
+        conv.touched = ev.ts
+
+        trace = conv.trace
+        if trace is None:
+            self.buffer.append(conv.id, seq, ev)
+        else:
+            started = time.time_ns()
             self.buffer.append(conv.id, seq, ev)
+            trace.record(f"emit:{event_type}", started, time.time_ns(), sequence=seq)
 
-            ev_id = ev.get("event_id")
-            if ev_id:
-                conv.sent_event_ids.add(ev_id)
+        if not conv.subscribers:
+            return
+        for conn in list(conv.subscribers):
+            if conn.closed:
+                # socket died without a close (send failed): stop feeding it
+                conv.subscribers.discard(conn)
+                self._watch_orphan(conv)
+                continue
+            conn.send(ev)
 
     # -------- Card --------
 
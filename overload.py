@@ -0,0 +1,128 @@
+"""Overload protection for the WebSocket gateway.
+
+`OverloadGuard` caps open sockets and in-flight generations per worker and
+sheds new work while the event loop is lagging. `TokenBucket` rate-limits
+inbound messages per connection. Rejections carry a retry-after hint so
+clients can back off instead of hammering a busy node.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+def overload_error(code: str, message: str, retry_after_ms: int) -> Dict[str, Any]:
+    """Payload of the `error` event sent when work is shed."""
+    return {"message": message, "code": code, "retry_after_ms": retry_after_ms}
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume one token. Returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class OverloadGuard:
+    def __init__(
+        self,
+        max_sockets: int = 2000,
+        max_generations: int = 200,
+        max_loop_lag_ms: float = 200.0,
+        message_rate: float = 5.0,
+        message_burst: float = 10.0,
+        retry_after_ms: int = 2000,
+    ):
+        self.max_sockets = max_sockets
+        self.max_generations = max_generations
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.message_rate = message_rate
+        self.message_burst = message_burst
+        self.retry_after_ms = retry_after_ms
+
+        self.open_sockets = 0
+        self.generations = 0
+        # set while the worker shuts down: no new sockets or generations
+        self.draining = False
+        self.loop_lag_ms = 0.0
+        self.shed: Dict[str, int] = {"sockets": 0, "generations": 0, "rate_limited": 0}
+
+    @classmethod
+    def from_env(cls) -> "OverloadGuard":
+        return cls(
+            max_sockets=int(os.getenv("MAX_OPEN_SOCKETS", "2000")),
+            max_generations=int(os.getenv("MAX_INFLIGHT_GENERATIONS", "200")),
+            max_loop_lag_ms=float(os.getenv("MAX_LOOP_LAG_MS", "200")),
+            message_rate=float(os.getenv("INBOUND_MESSAGES_PER_SECOND", "5")),
+            message_burst=float(os.getenv("INBOUND_MESSAGE_BURST", "10")),
+            retry_after_ms=int(os.getenv("OVERLOAD_RETRY_AFTER_MS", "2000")),
+        )
+
+    @property
+    def lagging(self) -> bool:
+        return self.loop_lag_ms > self.max_loop_lag_ms
+
+    # -------- admission checks (return a retry-after hint in ms, or None) --------
+
+    def admit_socket(self) -> Optional[int]:
+        if self.open_sockets >= self.max_sockets or self.lagging or self.draining:
+            self.shed["sockets"] += 1
+            return self.retry_after_ms
+        self.open_sockets += 1
+        return None
+
+    def release_socket(self) -> None:
+        self.open_sockets = max(0, self.open_sockets - 1)
+
+    def admit_generation(self) -> Optional[int]:
+        if self.generations >= self.max_generations or self.lagging or self.draining:
+            self.shed["generations"] += 1
+            return self.retry_after_ms
+        return None
+
+    def rate_limiter(self) -> TokenBucket:
+        return TokenBucket(self.message_rate, self.message_burst)
+
+    def rate_limited(self, bucket: TokenBucket) -> Optional[int]:
+        wait = bucket.take()
+        if wait <= 0:
+            return None
+        self.shed["rate_limited"] += 1
+        return int(wait * 1000) + 1
+
+    # -------- loop lag --------
+
+    async def monitor_loop_lag(self, interval: float = 0.5) -> None:
+        """Measure how late the loop wakes us up; a busy loop shows up as lag."""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            lag = (time.monotonic() - started - interval) * 1000
+            # smooth so a single GC pause does not flip shedding on and off
+            self.loop_lag_ms = max(0.0, 0.7 * self.loop_lag_ms + 0.3 * lag)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "open_sockets": self.open_sockets,
+            "max_sockets": self.max_sockets,
+            "generations": self.generations,
+            "max_generations": self.max_generations,
+            "loop_lag_ms": round(self.loop_lag_ms, 2),
+            "draining": self.draining,
+            "shed": dict(self.shed),
+        }
@@ -1,9 +1,19 @@
 """Pydantic schemas for the unified event envelope and payloads.
 
 All messages use the same envelope structure.
+
+Inbound client frames are decoded with `decode_envelope`: one pass through a
+compiled pydantic-core validator that parses the JSON, picks the envelope
+model by `type` and validates its payload, so the orchestrator receives typed
+objects instead of probing dicts.
 """
-from pydantic import BaseModel, Field
-from typing import Any, Dict, Optional
+import os
+
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, TypeAdapter
+from typing import Annotated, Any, Dict, Literal, Optional, Union
+
+# Frames larger than this are rejected before they are parsed
+MAX_FRAME_BYTES = int(os.getenv("MAX_INBOUND_FRAME_BYTES", "65536"))
 
 
 class Envelope(BaseModel):
@@ -15,19 +25,130 @@ class Envelope(BaseModel):
     payload: Dict[str, Any] = Field(default_factory=dict)
 
 
-class ResumePayload(BaseModel):
+class ClientPayload(BaseModel):
+    # clients attach extra fields (user context, args); keep them
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+
+    user_id: Optional[str] = None
+    user_info: Optional[Dict[str, Any]] = None
+
+
+class ResumePayload(ClientPayload):
     last_sequence: int
 
 
-class UserMessagePayload(BaseModel):
+class UserMessagePayload(ClientPayload):
     text: str
 
 
-class ActionPayload(BaseModel):
-    action_id: str
+class ActionPayload(ClientPayload):
+    # clients send the chosen card action as `id`, `action` or `action_id`
+    action_id: str = Field(validation_alias=AliasChoices("id", "action", "action_id"))
     params: Optional[Dict[str, Any]] = None
 
 
+class SubscribePayload(ClientPayload):
+    credits: Optional[int] = None
+    last_sequence: Optional[int] = None
+
+
+class CreditPayload(ClientPayload):
+    credits: int = 0
+
+
+class ClientEnvelope(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    conversation_id: str = Field(min_length=1)
+    event_id: Optional[str] = None
+    sequence: Optional[int] = None
+    ts: Optional[int] = None
+    user_id: Optional[str] = None
+    user_info: Optional[Dict[str, Any]] = None
+
+
+class UserMessageEnvelope(ClientEnvelope):
+    type: Literal["user_message"]
+    payload: UserMessagePayload
+
+
+class ActionEnvelope(ClientEnvelope):
+    type: Literal["action"]
+    payload: ActionPayload
+
+
+class ResumeEnvelope(ClientEnvelope):
+    type: Literal["resume"]
+    payload: ResumePayload
+
+
+class SubscribeEnvelope(ClientEnvelope):
+    type: Literal["subscribe"]
+    payload: SubscribePayload = Field(default_factory=SubscribePayload)
+
+
+class CreditEnvelope(ClientEnvelope):
+    type: Literal["credit"]
+    payload: CreditPayload = Field(default_factory=CreditPayload)
+
+
+class ControlEnvelope(ClientEnvelope):
+    """`stop` / `unsubscribe`: no payload fields of their own."""
+    type: Literal["stop", "unsubscribe"]
+    payload: ClientPayload = Field(default_factory=ClientPayload)
+
+
+class HeartbeatEnvelope(BaseModel):
+    """Connection-level `ping` / `pong`; not tied to a conversation."""
+    type: Literal["ping", "pong"]
+    conversation_id: Optional[str] = None
+    payload: Dict[str, Any] = Field(default_factory=dict)
+
+
+InboundEnvelope = Annotated[
+    Union[
+        UserMessageEnvelope, ActionEnvelope, ResumeEnvelope,
+        SubscribeEnvelope, CreditEnvelope, ControlEnvelope, HeartbeatEnvelope,
+    ],
+    Field(discriminator="type"),
+]
+
+# cache only keys: values (conversation ids, message text) are unique per
+# frame, and a cached value stays alive until pushed out of the cache
+_inbound = TypeAdapter(InboundEnvelope, config=ConfigDict(cache_strings="keys"))
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+def decode_envelope(raw: str | bytes) -> InboundEnvelope:
+    """
+    Parse and validate one inbound frame.
+
+    Raises `FrameTooLarge` for oversized frames and pydantic's
+    `ValidationError` (a ValueError) for malformed ones.
+    """
+    size = len(raw)
+    if isinstance(raw, str) and size <= MAX_FRAME_BYTES < size * 4:
+        # text frames count characters; measure UTF-8 bytes when they could exceed the limit
+        raw = raw.encode("utf-8")
+        size = len(raw)
+    if size > MAX_FRAME_BYTES:
+        raise FrameTooLarge(f"frame exceeds {MAX_FRAME_BYTES} bytes")
+    return _inbound.validate_json(raw)
+
+
+def describe_error(e: ValueError) -> str:
+    """Short client-facing description of a decode error."""
+    errors = getattr(e, "errors", None)
+    if not callable(errors):
+        return str(e)
+    first = errors(include_url=False)[0]
+    where = ".".join(str(p) for p in first["loc"])
+    return f"{where}: {first['msg']}" if where else first["msg"]
+
+
 class CardSection(BaseModel):
     kind: str
     data: Dict[str, Any]
@@ -1,4 +1,4 @@
-import json, os
+import asyncio, json, os
 from langchain.messages import HumanMessage, AIMessage, SystemMessage, AnyMessage
 from typing_extensions import Annotated
 from langgraph.graph.message import add_messages
@@ -11,61 +11,49 @@ from services.utils.nodes import (
     summarize_case_agent, general_agent, need_call, lock_card
 )
 from services.utils.status import append_status, get_status
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.prompts import HumanMessagePromptTemplate
-from services.utils.prompt_manager import all_prompts
+from services.utils.context import manage_context
+from services.utils.prompt_manager import prompt_registry
+from services.utils.tracing import traced_node
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import Command, interrupt
-from dotenv import load_dotenv
-
-# ใช้ AzureChatOpenAI
-from langchain_openai import AzureChatOpenAI
-
-load_dotenv()
+from services.utils.llm import FAMILY_PARAMS, get_llm
 
 
 class VBChatbot:
-    def __init__(self):
-        self.general_prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content=all_prompts['general_system']),
-            MessagesPlaceholder(variable_name="messages")
-        ])
-        self.intent_prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content=all_prompts['intent_system']),
-            MessagesPlaceholder(variable_name="messages")
-        ])
-        self.transaction_prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content=all_prompts['transaction_analyze_system']),
-            HumanMessagePromptTemplate.from_template(all_prompts['transaction_analyze_user']),
-        ])
-        self.case_summary_prompt = ChatPromptTemplate.from_messages([
-            SystemMessage(content=all_prompts['case_summary_system']),
-            HumanMessagePromptTemplate.from_template(all_prompts['case_summary_user']),
-        ])
-
-        # Azure OpenAI LLM factory
-        def _az_llm(temperature: float, max_tokens: int):
-            DEPLOYMENT_NAME = "gpt-4o-0513"
-            VERSION = "2024-02-15-preview"
-            BASE_URL = "https://digital-openai-prod-004.openai.azure.com/"
-            API_KEY = "5f99c21a65b5428f800d8c4e5f8655dd"
-            return AzureChatOpenAI(
-                azure_endpoint=BASE_URL,
-                azure_deployment=DEPLOYMENT_NAME,
-                openai_api_key=API_KEY,
-                openai_api_version=VERSION,
-                openai_api_type="azure",
-            )
-
-        # สร้างโมเดล (Azure)
-        self.general_model = self.general_prompt | _az_llm(temperature=0.2, max_tokens=2000)
-        self.intent_model = self.intent_prompt | _az_llm(temperature=0, max_tokens=100)
-        self.transaction_model = self.transaction_prompt | _az_llm(temperature=0.2, max_tokens=2000)
-        self.case_summary_model = self.case_summary_prompt | _az_llm(temperature=0.2, max_tokens=2000)
+    def __init__(self, backend: str | None = None):
+        # model clients are shared per worker (see services.utils.llm), keyed by prompt family
+        self.llms = {family: get_llm(family, backend) for family in FAMILY_PARAMS}
 
         self.graphs = {}
+        self._graph = None
         self.memory_saver = MemorySaver()
+        self._summary_tasks = {}
+
+    def _chain(self, name: str):
+        # templates are compiled once in the registry; looking them up per call
+        # picks up hot-reloaded prompt files
+        return prompt_registry.template(name) | self.llms[name]
+
+    @property
+    def general_model(self):
+        return self._chain("general")
+
+    @property
+    def intent_model(self):
+        return self._chain("intent")
+
+    @property
+    def transaction_model(self):
+        return self._chain("transaction_analyze")
+
+    @property
+    def case_summary_model(self):
+        return self._chain("case_summary")
+
+    @property
+    def conversation_summary_model(self):
+        return self._chain("conversation_summary")
 
     async def map_intent_node(self, state: MessageState):
         return await map_intent(state, self.intent_model)
@@ -79,35 +67,124 @@ class VBChatbot:
     async def general_agent_node(self, state: MessageState):
         return await general_agent(state, self.general_model)
 
-    async def build_graph(self, thread_id: str):
-        if thread_id in self.graphs:
-            return self.graphs[thread_id]
+    def compile_graph(self):
+        """Compile the graph once; threads are separated by thread_id in the checkpointer."""
+        if self._graph is not None:
+            return self._graph
 
         builder = StateGraph(MessageState)
-        builder.add_node("map_intent", self.map_intent_node)
-        builder.add_node("fetch_transactions", fetch_transactions)
-        builder.add_node("analyze_transactions_agent", self.analyze_transactions_node)
-        builder.add_node("lock_card", lock_card)
-        builder.add_node("general_agent", self.general_agent_node)
-        builder.add_node("need_call", need_call)
-        builder.add_node("summarize_case_agent", self.summarize_case_node)
-
-        builder.add_edge(START, "map_intent")
+        nodes = {
+            "manage_context": manage_context,
+            "map_intent": self.map_intent_node,
+            "fetch_transactions": fetch_transactions,
+            "analyze_transactions_agent": self.analyze_transactions_node,
+            "lock_card": lock_card,
+            "general_agent": self.general_agent_node,
+            "need_call": need_call,
+            "summarize_case_agent": self.summarize_case_node,
+        }
+        for name, node in nodes.items():
+            # span per node for sampled turns (see services.utils.tracing)
+            builder.add_node(name, traced_node(name, node))
+
+        builder.add_edge(START, "manage_context")
+        builder.add_edge("manage_context", "map_intent")
         builder.add_edge("fetch_transactions", "analyze_transactions_agent")
         builder.add_edge("analyze_transactions_agent", "lock_card")
         builder.add_edge("summarize_case_agent", END)
         builder.add_edge("general_agent", END)
         builder.add_edge("need_call", END)
 
-        graph = builder.compile(self.memory_saver)
+        self._graph = builder.compile(self.memory_saver)
+        return self._graph
+
+    async def build_graph(self, thread_id: str):
+        if thread_id in self.graphs:
+            return self.graphs[thread_id]
+        graph = self.compile_graph()
         self.graphs[thread_id] = graph
         return graph
 
+    def schedule_summary(self, thread_id: str):
+        """Fold dropped turns into the rolling summary in the background.
+
+        Called once a turn is done so the summarization call never delays a reply.
+        """
+        task = self._summary_tasks.get(thread_id)
+        if task and not task.done():
+            return
+        self._summary_tasks[thread_id] = asyncio.create_task(self.refresh_summary(thread_id))
+
+    async def refresh_summary(self, thread_id: str):
+        graph = self.graphs.get(thread_id)
+        if graph is None:
+            return
+        config = {"configurable": {"thread_id": thread_id}}
+        try:
+            snapshot = await graph.aget_state(config)
+            # never touch a thread that is paused on an interrupt
+            if snapshot.next:
+                return
+            pending = snapshot.values.get("pending_summary") or ""
+            if not pending:
+                return
+            result = await self.conversation_summary_model.ainvoke({
+                "summary": snapshot.values.get("summary") or "",
+                "transcript": pending,
+            })
+
+            # a new turn may have appended more dropped turns meanwhile; keep those
+            snapshot = await graph.aget_state(config)
+            if snapshot.next:
+                return
+            current = snapshot.values.get("pending_summary") or ""
+            remainder = current[len(pending):] if current.startswith(pending) else current
+            await graph.aupdate_state(config, {"summary": result.content, "pending_summary": remainder})
+        except Exception as e:
+            print(f"VBChatbot summary error: {e}")
+        finally:
+            self._summary_tasks.pop(thread_id, None)
+
+    def export_checkpoints(self) -> dict:
+        """Plain-dict copy of the MemorySaver contents (already serialized by its serde)."""
+        saver = self.memory_saver
+        return {
+            "storage": {thread: {ns: dict(cps) for ns, cps in nss.items()} for thread, nss in saver.storage.items()},
+            "writes": dict(saver.writes),
+            "blobs": dict(saver.blobs),
+        }
+
+    def import_checkpoints(self, data: dict) -> int:
+        """Load checkpoints saved by `export_checkpoints`; returns the number of threads."""
+        saver = self.memory_saver
+        for thread, nss in data.get("storage", {}).items():
+            for ns, cps in nss.items():
+                saver.storage[thread][ns].update(cps)
+        saver.writes.update(data.get("writes", {}))
+        saver.blobs.update(data.get("blobs", {}))
+        return len(data.get("storage", {}))
+
+    def forget_threads(self, thread_ids) -> None:
+        """Drop graphs, pending summaries and checkpoints of finished threads."""
+        thread_ids = set(thread_ids)
+        for thread_id in thread_ids:
+            self.graphs.pop(thread_id, None)
+            task = self._summary_tasks.pop(thread_id, None)
+            if task is not None:
+                task.cancel()
+        saver = self.memory_saver
+        for thread_id in thread_ids:
+            saver.storage.pop(thread_id, None)
+        # one pass over writes/blobs for the whole batch (delete_thread scans them per thread)
+        for table in (saver.writes, saver.blobs):
+            for key in [k for k in table if k[0] in thread_ids]:
+                del table[key]
+
     async def delete_graph(self, thread_id: str):
         if thread_id in self.graphs:
             del self.graphs[thread_id]
 
-    async def run(self, thread_id: str, message: str, resume: bool, user_info: dict):
+    async def run(self, thread_id: str, message: str, resume: bool, user_info: dict, cancel_scope=None, trace=None):
         try:
             graph = await self.build_graph(thread_id)
 
@@ -117,18 +194,18 @@ class VBChatbot:
                 input = {"messages": [HumanMessage(content=message)], "user_info": user_info}
                 print(f"Input messages: {message}")
 
-            config = {"configurable": {"thread_id": thread_id}}
+            # nodes pick the scope up via services.utils.cancellation.current_cancel_scope()
+            # and the sampled trace turn (or None) via services.utils.tracing.current_turn()
+            config = {"configurable": {"thread_id": thread_id, "cancel_scope": cancel_scope, "trace": trace}}
 
-            async for result in graph.astream(input, config=config, stream_mode=['updates', 'messages', 'custom']):
-                print(f"VBChatbot result: {result}")
+            # generating nodes stream their own tokens through the custom writer
+            # (see nodes.stream_model), so the 'messages' side channel is not needed
+            async for result in graph.astream(input, config=config, stream_mode=['updates', 'custom']):
                 if result[0] == 'updates':
                     if "__interrupt__" in result[1]:
                         yield "Interrupt:", result[1]["__interrupt__"][0].value['question']
                 if result[0] == 'custom':
                     yield result[1]
-                if result[0] == 'messages':
-                    if result[1][1]['langgraph_node'] != 'map_intent':
-                        yield result[1][0].content
 
         except Exception as e:
             print(f"VBChatbot error: {e}")
@@ -0,0 +1,88 @@
+"""Prompt-size control for the conversation history.
+
+`manage_context` runs as the first graph stage: it keeps the last
+CONTEXT_KEEP_TURNS user turns verbatim in `messages` and moves older turns into
+`pending_summary` as plain text. Folding that text into the rolling `summary`
+needs a model call, so it happens off the critical path after the turn is done
+(`VBChatbot.refresh_summary`). Nodes build their prompt with `build_context`,
+which prepends the summary and enforces a per-node token budget.
+"""
+import os
+from langchain.messages import AnyMessage, HumanMessage, RemoveMessage, SystemMessage
+from services.utils.state import MessageState
+
+KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "6"))
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# Intent classification only needs the recent turns
+NODE_TOKEN_BUDGETS = {
+    "map_intent": int(os.getenv("CONTEXT_TOKEN_BUDGET_INTENT", "1500")),
+    "general_agent": DEFAULT_TOKEN_BUDGET,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 chars per token is close enough for budgeting and needs no tokenizer
+    return len(text) // 4 + 4
+
+
+def _content(message: AnyMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def split_turns(messages: list[AnyMessage], keep_turns: int = KEEP_TURNS):
+    """Split history into (older, recent) where recent holds the last `keep_turns` user turns."""
+    seen = 0
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            seen += 1
+            if seen == keep_turns:
+                return messages[:i], messages[i:]
+    return [], messages
+
+
+def format_transcript(messages: list[AnyMessage]) -> str:
+    lines = []
+    for m in messages:
+        role = "User" if isinstance(m, HumanMessage) else "Assistant"
+        lines.append(f"{role}: {_content(m)}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+async def manage_context(state: MessageState):
+    older, _ = split_turns(state["messages"])
+    if not older:
+        return {}
+    pending = (state.get("pending_summary") or "") + format_transcript(older)
+    return {
+        "messages": [RemoveMessage(id=m.id) for m in older],
+        "pending_summary": pending,
+    }
+
+
+def build_context(state: MessageState, node: str) -> list[AnyMessage]:
+    """Messages to send for `node`: rolling summary + newest turns within the node's budget."""
+    budget = NODE_TOKEN_BUDGETS.get(node, DEFAULT_TOKEN_BUDGET)
+    messages = list(state["messages"])
+
+    prefix: list[AnyMessage] = []
+    memory = "\n".join(p for p in (state.get("summary"), state.get("pending_summary")) if p)
+    if memory:
+        # the summary may use at most a third of the budget; keep its newest part
+        max_chars = budget // 3 * 4
+        if len(memory) > max_chars:
+            memory = memory[-max_chars:]
+        prefix = [SystemMessage(content=f"Summary of the earlier conversation:\n{memory}")]
+        budget -= estimate_tokens(memory)
+
+    # drop the oldest messages until the rest fits (always keep the latest one)
+    kept: list[AnyMessage] = []
+    used = 0
+    for m in reversed(messages):
+        cost = estimate_tokens(_content(m))
+        if kept and used + cost > budget:
+            break
+        kept.append(m)
+        used += cost
+    kept.reverse()
+    return prefix + kept
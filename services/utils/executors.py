@@ -0,0 +1,169 @@
+"""Worker pools that keep CPU-bound and blocking work off the event loop.
+
+The event loop thread forwards tokens for every conversation on the worker,
+so anything that holds it for more than a few milliseconds delays all of
+them. Two pools take that work:
+
+- `cpu`: a process pool for parsing and scanning (large JSON files, the
+  status log). Functions must be importable top-level functions and their
+  arguments and results picklable. Small inputs go to the `io` pool
+  instead, where a process hop would cost more than the work.
+- `io`: a thread pool for blocking I/O (Redis round trips, event archive
+  reads, compression and commits, status log writes, trace export).
+
+Each pool admits at most `EXECUTOR_MAX_PENDING` calls at a time; further
+callers wait for a slot, so a burst cannot queue unbounded work. Queue depth
+and wait/run times are reported under `executors` in `/metrics`.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+EXECUTOR_CPU_WORKERS = int(os.getenv("EXECUTOR_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXECUTOR_IO_WORKERS = int(os.getenv("EXECUTOR_IO_WORKERS", "16"))
+# calls admitted to each pool at once (running + queued inside the executor)
+EXECUTOR_MAX_PENDING = int(os.getenv("EXECUTOR_MAX_PENDING", "256"))
+# CPU inputs smaller than this run in the I/O thread pool (0 always uses processes)
+EXECUTOR_CPU_MIN_BYTES = int(os.getenv("EXECUTOR_CPU_MIN_BYTES", "65536"))
+
+
+class Pool:
+    def __init__(self, name: str, factory: Callable[[], Executor], max_pending: int = EXECUTOR_MAX_PENDING):
+        self.name = name
+        self.factory = factory
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        # small CPU calls handed to the I/O pool
+        self.threaded = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.wait_ms = 0.0
+        self.run_ms = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        # created on first use so importing this module never starts workers
+        if self._executor is None:
+            self._executor = self.factory()
+        return self._executor
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # semaphores are bound to the loop that first waits on them
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._slots_loop = loop
+        return self._slots
+
+    @property
+    def pending(self) -> int:
+        return self.submitted - self.completed - self.failed
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run `fn(*args)` in the pool and wait for its result."""
+        slots = self._semaphore()
+        queued = time.monotonic()
+        if slots.locked():
+            # every slot taken: this call queues
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await slots.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await slots.acquire()
+
+        started = time.monotonic()
+        self.wait_ms += (started - queued) * 1000
+        self.submitted += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            slots.release()
+        self.completed += 1
+        self.run_ms += (time.monotonic() - started) * 1000
+        return result
+
+    def warm_up(self) -> int:
+        """Start the workers now rather than on the first real call."""
+        if isinstance(self.executor, ProcessPoolExecutor):
+            futures = [self.executor.submit(os.getpid) for _ in range(self.executor._max_workers)]
+            return len({f.result() for f in futures})
+        return 0
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        done = self.completed or 1
+        return {
+            "started": self._executor is not None,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "threaded": self.threaded,
+            "avg_wait_ms": round(self.wait_ms / done, 2),
+            "avg_run_ms": round(self.run_ms / done, 2),
+        }
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    # forkserver: workers are not forked from this (threaded) process
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=EXECUTOR_CPU_WORKERS, mp_context=multiprocessing.get_context(method))
+
+
+cpu = Pool("cpu", _process_pool)
+io = Pool("io", lambda: ThreadPoolExecutor(max_workers=EXECUTOR_IO_WORKERS, thread_name_prefix="io"))
+
+
+async def run_cpu(fn: Callable, *args, size: Optional[int] = None) -> Any:
+    """Run CPU-bound `fn(*args)` in the process pool.
+
+    `size` is the input size in bytes when known; small inputs run in the
+    I/O thread pool, still off the event loop.
+    """
+    if size is not None and size < EXECUTOR_CPU_MIN_BYTES:
+        cpu.threaded += 1
+        return await io.run(fn, *args)
+    return await cpu.run(fn, *args)
+
+
+async def run_io(fn: Callable, *args) -> Any:
+    """Run blocking `fn(*args)` in the I/O thread pool."""
+    return await io.run(fn, *args)
+
+
+def load_json(path: str) -> Any:
+    """Read and parse a JSON file (process-pool friendly)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def snapshot() -> Dict[str, Any]:
+    return {"cpu": cpu.snapshot(), "io": io.snapshot()}
+
+
+def shutdown() -> None:
+    cpu.shutdown()
+    io.shutdown()
@@ -0,0 +1,103 @@
+"""Chat model clients shared by every VBChatbot in the worker.
+
+Clients are created once per prompt family and share one pooled
+`httpx.AsyncClient`, so TLS connections to the model endpoint are reused
+across conversations and can be opened ahead of time with `prewarm_http`.
+`LLM_BACKEND=standin` swaps in the local stand-in model (no network).
+"""
+import asyncio
+import os
+from typing import Dict, Optional
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "azure")
+
+DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-0513")
+VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+BASE_URL = os.getenv("AZURE_OPENAI_ENDPOINT", "https://digital-openai-prod-004.openai.azure.com/")
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+
+# (temperature, max_tokens) per prompt family
+FAMILY_PARAMS = {
+    "general": (0.2, 2000),
+    "intent": (0, 100),
+    "transaction_analyze": (0.2, 2000),
+    "case_summary": (0.2, 2000),
+    "conversation_summary": (0, 400),
+}
+
+_http_async_client = None
+_llms: Dict[tuple, object] = {}
+
+
+def check_config() -> None:
+    """Fail at startup, not on the first model call, when the Azure key is missing."""
+    if LLM_BACKEND != "standin" and not os.environ.get("AZURE_OPENAI_API_KEY"):
+        raise RuntimeError("AZURE_OPENAI_API_KEY is not set (LLM_BACKEND=standin runs without it)")
+
+
+def http_async_client():
+    global _http_async_client
+    if _http_async_client is None:
+        import httpx
+
+        _http_async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+    return _http_async_client
+
+
+def get_llm(family: str, backend: Optional[str] = None):
+    backend = backend or LLM_BACKEND
+    key = (family, backend)
+    llm = _llms.get(key)
+    if llm is not None:
+        return llm
+
+    if backend == "standin":
+        from services.utils.standin import StandInChatModel
+
+        llm = StandInChatModel(family=family)
+    else:
+        # ใช้ AzureChatOpenAI
+        from langchain_openai import AzureChatOpenAI
+
+        temperature, max_tokens = FAMILY_PARAMS.get(family, (0.2, 2000))
+        llm = AzureChatOpenAI(
+            azure_endpoint=BASE_URL,
+            azure_deployment=DEPLOYMENT_NAME,
+            openai_api_key=os.environ["AZURE_OPENAI_API_KEY"],
+            openai_api_version=VERSION,
+            openai_api_type="azure",
+            temperature=temperature,
+            max_tokens=max_tokens,
+            http_async_client=http_async_client(),
+        )
+    _llms[key] = llm
+    return llm
+
+
+async def prewarm_http(connections: int = 4) -> int:
+    """Open pooled TLS connections to the model endpoint; returns how many succeeded.
+
+    Any HTTP response (even 401/404) means the connection is established and
+    parked in the pool for the first real request.
+    """
+    if LLM_BACKEND == "standin" or connections <= 0:
+        return 0
+    client = http_async_client()
+
+    async def _open():
+        try:
+            await client.get(BASE_URL)
+            return True
+        except Exception as e:
+            print(f"LLM pre-warm failed: {e}")
+            return False
+
+    results = await asyncio.gather(*(_open() for _ in range(connections)))
+    return sum(results)
@@ -2,18 +2,47 @@ from services.utils.state import MessageState
 from langgraph.types import Command
 from langchain.messages import SystemMessage, HumanMessage
 from langgraph.config import get_stream_writer
-import json, asyncio, aiofiles, os
+import json, asyncio, os
 from services.utils.status import append_status, get_status
+from services.utils.executors import load_json, run_cpu
 from langgraph.types import interrupt
-from services.utils.prompt_manager import all_prompts
+from services.utils.context import build_context
+from services.utils.cancellation import run_cancellable, current_cancel_scope
+from langchain_core.messages import AIMessage, message_chunk_to_message
 
 # Get the directory where this script is located
 current_dir = os.path.dirname(os.path.abspath(__file__))
 # Navigate to the mock_data directory relative to this script's location
 mock_data_dir = os.path.join(current_dir, "..", "mock_data")
 
+async def stream_model(model, inputs: dict, node: str):
+    """Stream a model call to the client and return the complete message.
+
+    Every chunk goes out through the custom stream writer as
+    {"stream": text, "node": node, "index": n}; the aggregated message is
+    returned for the graph state (an empty `AIMessage` if the stream had no
+    chunks). The cancel scope is checked between chunks, and leaving the loop
+    early closes the upstream response.
+    """
+    writer = get_stream_writer()
+    scope = current_cancel_scope()
+    full = None
+    index = 0
+    async for chunk in model.astream(inputs):
+        if scope is not None:
+            scope.raise_if_cancelled()
+        full = chunk if full is None else full + chunk
+        if chunk.content:
+            writer({"stream": chunk.content, "node": node, "index": index})
+            index += 1
+    if full is None:
+        # the model ended the stream without a chunk
+        return AIMessage(content="")
+    return message_chunk_to_message(full)
+
+
 async def map_intent(state: MessageState, model_intent):
-    intent = await model_intent.ainvoke({"messages": state["messages"]})
+    intent = await run_cancellable(model_intent.ainvoke({"messages": build_context(state, "map_intent")}))
     if intent.content not in ["general", "need_call", "lock_card", "unusual_transaction", "check_status"]:
         mapping_intent = "general"
     else:
@@ -36,13 +65,12 @@ async def fetch_transactions(state: MessageState):
     # writer("Analyzing your account...")
     # writer("Security check in progress...")
     transactions_file = os.path.join(mock_data_dir, "transactions.json")
-    async with aiofiles.open(transactions_file, 'r', encoding='utf-8') as f:
-        content = await f.read()
-    transactions = json.loads(content)
+    # large statements are parsed in the process pool, off the event loop
+    transactions = await run_cpu(load_json, transactions_file, size=os.path.getsize(transactions_file))
     return {"transactions" : transactions}
 
 async def analyze_transactions_agent(state: MessageState, model_analyze):
-    message = await model_analyze.ainvoke({"transactions": state["transactions"]})
+    message = await stream_model(model_analyze, {"transactions": state["transactions"]}, "analyze_transactions_agent")
     
     await append_status(state["user_info"]['user_id'], {"unusaual_transaction": {"Reported": "Done", "Investigation": "In Progress", "Resolved": "No"}})
     return {"messages" : message}
@@ -78,11 +106,11 @@ async def summarize_case_agent(state: MessageState, model_summarize):
     writer = get_stream_writer()
     status = await get_status(state["user_info"]['user_id'])
     writer({"case_progress":status})
-    message = await model_summarize.ainvoke({"status": status})
+    message = await stream_model(model_summarize, {"status": status}, "summarize_case_agent")
     return {"messages" : message}
 
 async def general_agent(state: MessageState, model_general):
-    message = await model_general.ainvoke({"messages": state["messages"]})
+    message = await stream_model(model_general, {"messages": build_context(state, "general_agent")}, "general_agent")
     return {"messages" : message}
 
 async def need_call(state: MessageState):
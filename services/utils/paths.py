@@ -0,0 +1,12 @@
+"""Paths relative to the backend directory rather than the launch directory."""
+import os
+
+# main.py exports VB_BACKEND_DIR before importing anything else
+BACKEND_DIR = os.getenv("VB_BACKEND_DIR") or os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+def backend_path(path: str) -> str:
+    """Resolve a relative `path` against the backend directory; absolute and empty paths are kept."""
+    if not path or os.path.isabs(path):
+        return path
+    return os.path.join(BACKEND_DIR, path)
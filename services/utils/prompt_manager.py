@@ -1,32 +1,107 @@
-import json
+"""Prompt registry.
+
+Prompt files live in `services/prompts/<name>/system_prompt.txt` (and an
+optional `user_prompt.txt`). Files are read on first use, compiled once into a
+`ChatPromptTemplate` and cached; `reload_if_changed()` re-reads files whose
+mtime changed so prompts can be edited without restarting the worker.
+"""
 import os
+from typing import Dict, List, Optional
 
 # Get the directory where this script is located
 current_dir = os.path.dirname(os.path.abspath(__file__))
 # Navigate to the prompts directory relative to this script's location
 prompts_dir = os.path.join(current_dir, "..", "prompts")
 
-all_prompts = {}
 prompts_to_load = [
     "intent_system",
     "case_summary_system",
     "case_summary_user",
     "general_system",
     "transaction_analyze_system",
-    "transaction_analyze_user"]
-
-for prompt in prompts_to_load:
-    prompt_name = prompt.split("_")[:-1]
-    if len(prompt_name) == 1:
-        prompt_name = prompt_name[0]
-    else:
-        prompt_name = "_".join(prompt_name)
-    prompt_sub = prompt.split("_")[-1]
-    if prompt_sub == "system":
-        
-        with open(os.path.join(prompts_dir, prompt_name, "system_prompt.txt"), "r", encoding="utf-8") as f:
-            all_prompts[prompt] = f.read()
-    elif prompt_sub == "user":
-        with open(os.path.join(prompts_dir, prompt_name, "user_prompt.txt"), "r", encoding="utf-8") as f:
-            all_prompts[prompt] = f.read()
+    "transaction_analyze_user",
+    "conversation_summary_system",
+    "conversation_summary_user"]
+
+
+def _prompt_path(prompt: str) -> str:
+    # "case_summary_user" -> prompts/case_summary/user_prompt.txt
+    prompt_name, prompt_sub = prompt.rsplit("_", 1)
+    return os.path.join(prompts_dir, prompt_name, f"{prompt_sub}_prompt.txt")
+
+
+class PromptRegistry:
+    def __init__(self, names: List[str] = prompts_to_load):
+        self.names = list(names)
+        self._texts: Dict[str, str] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._templates: Dict[str, object] = {}
+
+    def _load(self, prompt: str) -> str:
+        path = _prompt_path(prompt)
+        with open(path, "r", encoding="utf-8") as f:
+            self._texts[prompt] = f.read()
+        self._mtimes[prompt] = os.path.getmtime(path)
+        return self._texts[prompt]
+
+    def text(self, prompt: str) -> str:
+        if prompt not in self._texts:
+            return self._load(prompt)
+        return self._texts[prompt]
+
+    def template(self, name: str):
+        """Compiled chat template for a prompt family, e.g. "general".
+
+        Families with a user prompt render it as a human message template;
+        the others take the conversation through a `messages` placeholder.
+        """
+        tpl = self._templates.get(name)
+        if tpl is not None:
+            return tpl
+
+        from langchain.messages import SystemMessage
+        from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+
+        user: Optional[str] = None
+        if f"{name}_user" in self.names:
+            user = self.text(f"{name}_user")
+        tpl = ChatPromptTemplate.from_messages([
+            SystemMessage(content=self.text(f"{name}_system")),
+            HumanMessagePromptTemplate.from_template(user) if user is not None
+            else MessagesPlaceholder(variable_name="messages"),
+        ])
+        self._templates[name] = tpl
+        return tpl
+
+    def families(self) -> List[str]:
+        return sorted({p.rsplit("_", 1)[0] for p in self.names})
+
+    def warm(self) -> None:
+        """Read and compile every prompt now instead of on first request."""
+        for name in self.families():
+            self.template(name)
+
+    def reload_if_changed(self) -> List[str]:
+        """Re-read prompt files whose mtime changed; returns the reloaded names."""
+        changed = []
+        for prompt, mtime in list(self._mtimes.items()):
+            try:
+                current = os.path.getmtime(_prompt_path(prompt))
+            except OSError:
+                continue
+            if current != mtime:
+                self._load(prompt)
+                changed.append(prompt)
+        for prompt in changed:
+            self._templates.pop(prompt.rsplit("_", 1)[0], None)
+        return changed
+
+
+prompt_registry = PromptRegistry()
+
 
+def __getattr__(name: str):
+    # backwards compatible `all_prompts` dict, built only when someone asks for it
+    if name == "all_prompts":
+        return {p: prompt_registry.text(p) for p in prompts_to_load}
+    raise AttributeError(name)
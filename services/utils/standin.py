@@ -0,0 +1,84 @@
+"""Local stand-in for the Azure chat model.
+
+Used for the synthetic warm-up conversation and for load/soak runs
+(`LLM_BACKEND=standin`). It streams a canned reply with a configurable
+per-token delay, and answers the intent prompt by keyword so every graph
+branch can be exercised without network access.
+"""
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+TOKEN_DELAY_MS = float(os.getenv("STANDIN_TOKEN_DELAY_MS", "5"))
+
+REPLY = (
+    "ขอบคุณที่ติดต่อเรา ทางเราได้ตรวจสอบข้อมูลของท่านแล้ว "
+    "หากท่านต้องการความช่วยเหลือเพิ่มเติม กรุณาแจ้งให้เราทราบ. "
+)
+
+# first matching keyword wins
+INTENT_KEYWORDS = [
+    ("lock", "lock_card"),
+    ("ล็อค", "lock_card"),
+    ("unusual", "unusual_transaction"),
+    ("charge", "unusual_transaction"),
+    ("ผิดปกติ", "unusual_transaction"),
+    ("status", "check_status"),
+    ("สถานะ", "check_status"),
+    ("agent", "need_call"),
+    ("call", "need_call"),
+]
+
+
+def classify(messages: List[BaseMessage]) -> str:
+    for m in reversed(messages):
+        if isinstance(m, HumanMessage):
+            text = str(m.content).lower()
+            for keyword, intent in INTENT_KEYWORDS:
+                if keyword in text:
+                    return intent
+            return "general"
+    return "general"
+
+
+class StandInChatModel(BaseChatModel):
+    family: str = "general"
+    reply: str = REPLY
+    token_delay_ms: float = TOKEN_DELAY_MS
+
+    @property
+    def _llm_type(self) -> str:
+        return "standin"
+
+    def _answer(self, messages: List[BaseMessage]) -> List[str]:
+        if self.family == "intent":
+            return [classify(messages)]
+        # split into word-sized pieces so streaming looks like a real model
+        return [w + " " for w in self.reply.split(" ") if w]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        pieces = self._answer(messages)
+        time.sleep(self.token_delay_ms * len(pieces) / 1000)
+        text = "".join(pieces).strip() if self.family != "intent" else pieces[0]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for piece in self._answer(messages):
+            time.sleep(self.token_delay_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        pieces = self._answer(messages)
+        await asyncio.sleep(self.token_delay_ms * len(pieces) / 1000)
+        text = "".join(pieces).strip() if self.family != "intent" else pieces[0]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for piece in self._answer(messages):
+            await asyncio.sleep(self.token_delay_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
@@ -7,4 +7,8 @@ class MessageState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     user_info: dict
     intent: str
-    transactions: list[dict]
\ No newline at end of file
+    transactions: list[dict]
+    # rolling summary of turns dropped from `messages` (see services.utils.context)
+    summary: str
+    # dropped turns not yet folded into `summary`
+    pending_summary: str
\ No newline at end of file
@@ -1,34 +1,130 @@
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
-import json, asyncio, aiofiles, os
+import json, asyncio, os
+from services.utils.executors import run_cpu, run_io
 
 # Get the directory where this script is located
 current_dir = os.path.dirname(os.path.abspath(__file__))
 # Navigate to the mock_data directory relative to this script's location
 mock_data_dir = os.path.join(current_dir, "..", "mock_data")
 
-async def append_status(user_id: str, status: dict, path=None):
+STATUS_QUEUE_SIZE = int(os.getenv("STATUS_QUEUE_SIZE", "10000"))
+STATUS_BATCH_SIZE = int(os.getenv("STATUS_BATCH_SIZE", "256"))
+# fsync after every batch (durable across power loss, slower)
+STATUS_FSYNC = os.getenv("STATUS_FSYNC", "0") == "1"
+
+
+class StatusWriter:
+    """Single writer for a status file with group commit.
+
+    Status events from every conversation go through one bounded queue; a
+    background task writes whatever has accumulated as one batch (one write,
+    one flush, optionally one fsync) and then resolves each caller's future,
+    so `write` returns only once the event is on disk and lines from
+    concurrent writers never interleave.
+    """
+
+    def __init__(self, path: str, max_queue: int = STATUS_QUEUE_SIZE, max_batch: int = STATUS_BATCH_SIZE, fsync: bool = STATUS_FSYNC):
+        self.path = path
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.written = 0
+        self._file = None
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, event: dict) -> None:
+        """Queue one event and wait until its batch is committed."""
+        fut = asyncio.get_running_loop().create_future()
+        # bounded: waits here when the disk cannot keep up
+        await self.queue.put((json.dumps(event, ensure_ascii=False) + "\n", fut))
+        await fut
+
+    def _commit(self, data: str) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                await run_io(self._commit, "".join(line for line, _ in batch))
+                self.batches += 1
+                self.written += len(batch)
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_result(None)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def close(self):
+        await self.queue.join()
+        self._task.cancel()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_writers = {}
+
+
+def status_writer(path=None) -> StatusWriter:
     if path is None:
         path = os.path.join(mock_data_dir, "status_db.ndjson")
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(path)
+    # writers are bound to the loop that created them
+    if writer is None or writer._task.get_loop() is not loop or writer._task.done():
+        if writer is not None and writer._file is not None:
+            writer._file.close()
+        writer = _writers[path] = StatusWriter(path)
+    return writer
+
+
+async def close_writers() -> int:
+    """Flush and close every status writer (shutdown); returns how many there were."""
+    writers = list(_writers.values())
+    _writers.clear()
+    await asyncio.gather(*(w.close() for w in writers if not w._task.done()))
+    return len(writers)
+
+
+async def append_status(user_id: str, status: dict, path=None):
     event = {
         "user_id": user_id,
         "ts": datetime.now(ZoneInfo("Asia/Bangkok")).isoformat(),
         **status
     }
-    async with aiofiles.open(path, "a", encoding="utf-8") as f:
-        await f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    await status_writer(path).write(event)
+
+def scan_status(path: str, user_id: str) -> dict:
+    """Fold every status event of `user_id` in the log (runs in the process pool)."""
+    status = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            if event["user_id"] == user_id:
+                status.update({k: v for k, v in event.items() if k not in ["user_id", "ts"]})
+    return status
+
 
 async def get_status(user_id: str, path=None):
     if path is None:
         path = os.path.join(mock_data_dir, "status_db.ndjson")
-    status = {}
     try:
-        async with aiofiles.open(path, "r", encoding="utf-8") as f:
-            async for line in f:
-                event = json.loads(line)
-                if event["user_id"] == user_id:
-                    status.update({k: v for k, v in event.items() if k not in ["user_id", "ts"]})
+        return await run_cpu(scan_status, path, user_id, size=os.path.getsize(path))
     except FileNotFoundError:
         # If file doesn't exist yet, return empty status
-        pass
-    return status
\ No newline at end of file
+        return {}
\ No newline at end of file
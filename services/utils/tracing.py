@@ -0,0 +1,221 @@
+"""Lightweight per-turn tracing for latency debugging.
+
+A turn (one user message or action, from receive to the end of its run) is
+sampled at `TRACE_SAMPLE_RATE`; conversations being investigated can be
+watched so every turn of theirs is traced. A sampled turn records spans
+for the mailbox wait, admission, each LangGraph node, the first model chunk,
+each emitted event with its buffer append, and each socket send. Unsampled
+turns cost one `is None` check per hook.
+
+Finished turns are appended to `TRACE_EXPORT_PATH` as OTLP-compatible JSON
+(one `resourceSpans` document per line) and the most recent ones are kept
+in memory for the `/debug/trace/{conversation_id}` endpoint.
+
+The orchestrator passes the turn to the graph via
+`config["configurable"]["trace"]`, the same way as the cancel scope.
+"""
+import asyncio
+import functools
+import json
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from services.utils.executors import run_io
+from services.utils.paths import backend_path
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_EXPORT_PATH = backend_path(os.getenv("TRACE_EXPORT_PATH", "traces.jsonl"))
+# finished turns kept in memory per conversation, and conversations kept
+TRACE_KEEP_TURNS = int(os.getenv("TRACE_KEEP_TURNS", "10"))
+TRACE_KEEP_CONVERSATIONS = int(os.getenv("TRACE_KEEP_CONVERSATIONS", "1000"))
+# spans per turn; long streams stop recording instead of growing without bound
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "2000"))
+
+SERVICE_NAME = "streaming-api"
+
+
+class Turn:
+    __slots__ = ("trace_id", "conversation_id", "name", "start_ns", "end_ns", "attrs", "spans", "dropped")
+
+    def __init__(self, conversation_id: str, name: str, start_ns: int, attrs: Dict[str, Any]):
+        self.trace_id = os.urandom(16).hex()
+        self.conversation_id = conversation_id
+        self.name = name
+        self.start_ns = start_ns
+        self.end_ns: Optional[int] = None
+        self.attrs = attrs
+        # (name, start_ns, end_ns, attrs)
+        self.spans: List[tuple] = []
+        self.dropped = 0
+
+    def record(self, name: str, start_ns: int, end_ns: Optional[int] = None, **attrs) -> None:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((name, start_ns, end_ns if end_ns is not None else start_ns, attrs))
+
+    def mark(self, name: str, **attrs) -> None:
+        """Zero-length span: a point in time such as the first chunk."""
+        self.record(name, time.time_ns(), **attrs)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        start = time.time_ns()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.time_ns(), **attrs)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        root_id = os.urandom(8).hex()
+        end = self.end_ns or time.time_ns()
+        spans = [_otlp_span(self.trace_id, root_id, None, self.name, self.start_ns, end, {
+            "conversation_id": self.conversation_id, "dropped_spans": self.dropped, **self.attrs,
+        })]
+        for name, start, stop, attrs in self.spans:
+            spans.append(_otlp_span(self.trace_id, os.urandom(8).hex(), root_id, name, start, stop, attrs))
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attrs({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }]
+        }
+
+
+def _otlp_attrs(attrs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    out = []
+    for key, value in attrs.items():
+        if isinstance(value, bool):
+            v = {"boolValue": value}
+        elif isinstance(value, int):
+            v = {"intValue": str(value)}
+        elif isinstance(value, float):
+            v = {"doubleValue": value}
+        else:
+            v = {"stringValue": str(value)}
+        out.append({"key": key, "value": v})
+    return out
+
+
+def _otlp_span(trace_id, span_id, parent_id, name, start, end, attrs) -> Dict[str, Any]:
+    span = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(start),
+        "endTimeUnixNano": str(end),
+        "attributes": _otlp_attrs(attrs),
+    }
+    if parent_id:
+        span["parentSpanId"] = parent_id
+    return span
+
+
+class Tracer:
+    def __init__(
+        self,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        export_path: Optional[str] = TRACE_EXPORT_PATH,
+        keep_turns: int = TRACE_KEEP_TURNS,
+        keep_conversations: int = TRACE_KEEP_CONVERSATIONS,
+    ):
+        self.sample_rate = sample_rate
+        self.export_path = export_path or None
+        self.keep_turns = keep_turns
+        self.keep_conversations = keep_conversations
+        # conversation_id -> turn in flight (sampled only)
+        self.active: Dict[str, Turn] = {}
+        # conversations traced on every turn
+        self.watched: Set[str] = set()
+        self.recent: "OrderedDict[str, Deque[Turn]]" = OrderedDict()
+        # export writes in flight (held so they are not garbage collected)
+        self._exports: Set[asyncio.Task] = set()
+
+    def watch(self, conversation_id: str) -> None:
+        self.watched.add(conversation_id)
+
+    def unwatch(self, conversation_id: str) -> None:
+        self.watched.discard(conversation_id)
+
+    def start_turn(self, conversation_id: str, name: str, start_ns: Optional[int] = None, **attrs) -> Optional[Turn]:
+        """Begin a turn if it is sampled; returns None otherwise."""
+        if conversation_id not in self.watched and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        turn = Turn(conversation_id, name, start_ns or time.time_ns(), attrs)
+        self.active[conversation_id] = turn
+        return turn
+
+    def end_turn(self, turn: Optional[Turn]) -> None:
+        if turn is None or turn.end_ns is not None:
+            return
+        turn.end_ns = time.time_ns()
+        if self.active.get(turn.conversation_id) is turn:
+            del self.active[turn.conversation_id]
+
+        kept = self.recent.get(turn.conversation_id)
+        if kept is None:
+            kept = self.recent[turn.conversation_id] = deque(maxlen=self.keep_turns)
+            while len(self.recent) > self.keep_conversations:
+                self.recent.popitem(last=False)
+        else:
+            self.recent.move_to_end(turn.conversation_id)
+        kept.append(turn)
+
+        if self.export_path:
+            line = json.dumps(turn.to_otlp()) + "\n"
+            try:
+                task = asyncio.get_running_loop().create_task(self._export(line))
+            except RuntimeError:
+                self._write(line)
+            else:
+                self._exports.add(task)
+                task.add_done_callback(self._exports.discard)
+
+    async def _export(self, line: str) -> None:
+        try:
+            await run_io(self._write, line)
+        except Exception as e:
+            print(f"[TRACE] export failed: {e}")
+
+    def _write(self, line: str) -> None:
+        with open(self.export_path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def turns(self, conversation_id: str) -> List[Turn]:
+        """Recent finished turns plus the one in flight, oldest first."""
+        turns = list(self.recent.get(conversation_id, ()))
+        if conversation_id in self.active:
+            turns.append(self.active[conversation_id])
+        return turns
+
+
+tracer = Tracer()
+
+
+def current_turn() -> Optional[Turn]:
+    """Turn of the graph run this node belongs to (None when not sampled)."""
+    from langgraph.config import get_config
+
+    try:
+        return get_config().get("configurable", {}).get("trace")
+    except RuntimeError:
+        return None
+
+
+def traced_node(name: str, node):
+    """Wrap an async graph node so sampled turns get a `node:<name>` span."""
+
+    @functools.wraps(node)
+    async def wrapper(*args, **kwargs):
+        turn = current_turn()
+        if turn is None:
+            return await node(*args, **kwargs)
+        with turn.span(f"node:{name}"):
+            return await node(*args, **kwargs)
+
+    return wrapper
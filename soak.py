@@ -0,0 +1,349 @@
+"""Soak test: long-running conversation churn with a memory-growth check.
+
+Runs the real app under uvicorn in this process with the local stand-in
+model (`LLM_BACKEND=standin`) and the in-process event buffer, and drives
+simulated WebSocket clients against it for `--duration` seconds. Each
+client repeatedly picks a scenario:
+
+- converse:  one to three turns, then disconnect
+- action:    trigger the lock-card confirmation and answer it
+- interrupt: `stop` or supersede a reply while it streams
+- resume:    drop the socket mid-reply, reconnect and `resume`
+- abandon:   drop the socket mid-reply and never come back
+
+Every `--sample-interval` seconds it prints tracemalloc and RSS totals,
+the live conversation / graph / checkpoint counts, and the object types
+that grew most since the baseline.
+
+The churn runs in two halves. After each, every conversation is left to go
+idle until the cleanup loop has evicted it, and the retained memory
+(tracemalloc, after gc) is measured against a baseline taken after warm-up.
+One-off growth such as caches filling up lands in the first half; what
+accumulates over the second half, divided by its conversations, is the
+per-conversation leak. The exit status is 1 if that exceeds `--max-retained-bytes` or if
+conversations are still held after settling.
+
+    python soak.py --duration 3600 --clients 50
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+# stand-in model, in-process buffer, short retention so "conversations end" is reachable
+for _key, _value in {
+    "LLM_BACKEND": "standin",
+    "EVENT_BUFFER_BACKEND": "memory",
+    "EVENT_BUFFER_TTL_SECONDS": "2",
+    "EVENT_ARCHIVE_PATH": "",
+    "IDEMPOTENCY_TTL_SECONDS": "2",
+    "CONVERSATION_IDLE_SECONDS": "2",
+    "CLEANUP_INTERVAL_SECONDS": "1",
+    "ORPHAN_GRACE_SECONDS": "1",
+    "STANDIN_TOKEN_DELAY_MS": "2",
+    "TRACE_SAMPLE_RATE": "0",
+    "TRACE_EXPORT_PATH": "",
+    "DRAIN_STATE_DIR": "",
+    "PROMPT_RELOAD_SECONDS": "0",
+}.items():
+    os.environ.setdefault(_key, _value)
+
+import uvicorn
+import websockets
+
+MESSAGES = [
+    "hello, what can you do?",
+    "what is the status of my case?",
+    "please explain my last statement",
+    "thank you",
+]
+LOCK_MESSAGE = "please lock my card"
+SCENARIOS = ["converse", "action", "interrupt", "resume", "abandon"]
+READ_TIMEOUT = 30.0
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def type_counts() -> Counter:
+    return Counter(type(o).__name__ for o in gc.get_objects())
+
+
+class Client:
+    """One simulated user; counts what it did in `stats`."""
+
+    def __init__(self, url: str, index: int, stats: Counter, rng: random.Random):
+        self.url = url
+        self.index = index
+        self.stats = stats
+        self.rng = rng
+        self.turns = 0
+
+    def _new_conversation(self) -> str:
+        self.turns += 1
+        self.stats["conversations"] += 1
+        return f"soak-{self.index}-{self.turns}"
+
+    async def _send(self, ws, event_type: str, conversation_id: str, payload: dict) -> None:
+        await ws.send(json.dumps({
+            "type": event_type,
+            "conversation_id": conversation_id,
+            "user_id": f"soak-user-{self.index}",
+            "payload": payload,
+        }))
+
+    async def _read(self, ws, conversation_id: str, until=("done", "error"), tokens=None, last=0):
+        """Read conversation events until a type in `until` (or `tokens` tokens).
+
+        Returns (last event type, last sequence seen).
+        """
+        seen = 0
+        while True:
+            msg = json.loads(await asyncio.wait_for(ws.recv(), READ_TIMEOUT))
+            if msg.get("conversation_id") != conversation_id:
+                continue  # heartbeat pings
+            last = max(last, msg.get("sequence") or 0)
+            kind = msg["type"]
+            if kind in until:
+                return kind, last
+            if kind == "token":
+                seen += 1
+                if tokens is not None and seen >= tokens:
+                    return kind, last
+
+    async def converse(self):
+        conv_id = self._new_conversation()
+        async with websockets.connect(self.url) as ws:
+            for _ in range(self.rng.randint(1, 3)):
+                await self._send(ws, "user_message", conv_id, {"text": self.rng.choice(MESSAGES)})
+                await self._read(ws, conv_id)
+
+    async def action(self):
+        conv_id = self._new_conversation()
+        async with websockets.connect(self.url) as ws:
+            await self._send(ws, "user_message", conv_id, {"text": LOCK_MESSAGE})
+            kind, _ = await self._read(ws, conv_id, until=("card", "done", "error"))
+            if kind == "card":
+                # "cancel" keeps the mock status log untouched
+                await self._send(ws, "action", conv_id, {"id": "cancel"})
+                await self._read(ws, conv_id)
+
+    async def interrupt(self):
+        conv_id = self._new_conversation()
+        async with websockets.connect(self.url) as ws:
+            await self._send(ws, "user_message", conv_id, {"text": self.rng.choice(MESSAGES)})
+            kind, _ = await self._read(ws, conv_id, tokens=1)
+            if kind == "token":
+                if self.rng.random() < 0.5:
+                    await self._send(ws, "stop", conv_id, {})
+                else:
+                    await self._send(ws, "user_message", conv_id, {"text": self.rng.choice(MESSAGES)})
+                await self._read(ws, conv_id)
+
+    async def resume(self):
+        conv_id = self._new_conversation()
+        async with websockets.connect(self.url) as ws:
+            await self._send(ws, "user_message", conv_id, {"text": self.rng.choice(MESSAGES)})
+            kind, last = await self._read(ws, conv_id, tokens=1)
+        if kind != "token":
+            return
+        await asyncio.sleep(self.rng.uniform(0, 0.5))
+        async with websockets.connect(self.url) as ws:
+            await self._send(ws, "resume", conv_id, {"last_sequence": last})
+            await self._read(ws, conv_id, last=last)
+
+    async def abandon(self):
+        conv_id = self._new_conversation()
+        async with websockets.connect(self.url) as ws:
+            await self._send(ws, "user_message", conv_id, {"text": self.rng.choice(MESSAGES)})
+            await self._read(ws, conv_id, tokens=1)
+
+    async def run(self, deadline: float, think_time: float):
+        while time.monotonic() < deadline:
+            scenario = self.rng.choice(SCENARIOS)
+            try:
+                await getattr(self, scenario)()
+                self.stats[scenario] += 1
+            except (asyncio.TimeoutError, OSError, websockets.WebSocketException) as e:
+                self.stats["failed"] += 1
+                self.stats[f"failed:{type(e).__name__}"] += 1
+            await asyncio.sleep(self.rng.uniform(0, think_time))
+
+
+class Sampler:
+    def __init__(self, main, out):
+        self.main = main
+        self.out = out
+        self.started = time.monotonic()
+        self.baseline_bytes = 0
+        self.baseline_types: Counter = Counter()
+
+    def baseline(self):
+        gc.collect()
+        self.baseline_bytes = tracemalloc.get_traced_memory()[0]
+        self.baseline_types = type_counts()
+
+    def live(self) -> dict:
+        orch = self.main.orch
+        vb = orch._chatbot
+        return {
+            "conversations": len(orch.conversations),
+            "graphs": len(vb.graphs) if vb else 0,
+            "checkpoint_threads": len(vb.memory_saver.storage) if vb else 0,
+            "buffered": len(getattr(self.main.buffer, "rings", ())),
+            "dedup": orch.dedup.snapshot()["entries"],
+        }
+
+    def sample(self, stats: Counter):
+        traced = tracemalloc.get_traced_memory()[0]
+        growth = (type_counts() - self.baseline_types).most_common(5)
+        print(
+            f"[{time.monotonic() - self.started:7.0f}s] "
+            f"traced={traced / 1e6:.1f}MB (+{(traced - self.baseline_bytes) / 1e6:.1f}) "
+            f"rss={rss_bytes() / 1e6:.1f}MB "
+            f"conversations_started={stats['conversations']} live={self.live()} "
+            f"grown={growth}",
+            file=self.out, flush=True,
+        )
+
+    def retained(self) -> int:
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - self.baseline_bytes
+
+    def mark(self):
+        gc.collect()
+        self.snapshot = tracemalloc.take_snapshot()
+
+    def growth(self) -> tuple:
+        """Bytes gained since `mark` at allocation sites holding more blocks than then.
+
+        A site that only re-allocated one block is a table resize (a dict or
+        list that grew once and stays sized for its peak), not memory that
+        accumulates per conversation.
+        """
+        gc.collect()
+        stats = tracemalloc.take_snapshot().compare_to(self.snapshot, "lineno")
+        return sum(st.size_diff for st in stats if st.count_diff > 1), stats
+
+    def report_growth(self, stats, limit: int = 10):
+        print("top allocation growth over the second half:", file=self.out)
+        for stat in stats[:limit]:
+            print(f"  {stat}", file=self.out)
+        print(f"object types grown: {(type_counts() - self.baseline_types).most_common(10)}", file=self.out)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def soak(args, out) -> int:
+    import main
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    # wait for the startup warm-up, like a load balancer polling /readyz
+    while not (server.started and main.ready):
+        await asyncio.sleep(0.05)
+    url = f"ws://127.0.0.1:{port}/chat/stream"
+
+    rng = random.Random(args.seed)
+    stats: Counter = Counter()
+
+    # one round of every scenario, so caches and lazily built objects exist before the baseline
+    warm = Client(url, -1, Counter(), rng)
+    for scenario in SCENARIOS:
+        await getattr(warm, scenario)()
+    idle_seconds = float(os.environ["CONVERSATION_IDLE_SECONDS"]) + float(os.environ["EVENT_BUFFER_TTL_SECONDS"])
+    idle_wait = idle_seconds + 2 * float(os.environ["CLEANUP_INTERVAL_SECONDS"])
+    await asyncio.sleep(idle_wait)
+
+    sampler = Sampler(main, out)
+    sampler.baseline()
+    print(f"baseline: traced={sampler.baseline_bytes / 1e6:.1f}MB rss={rss_bytes() / 1e6:.1f}MB", file=out)
+
+    async def churn(seconds: float):
+        deadline = time.monotonic() + seconds
+        clients = [
+            asyncio.create_task(Client(url, i, stats, random.Random(rng.random())).run(deadline, args.think_time))
+            for i in range(args.clients)
+        ]
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(args.sample_interval, max(0.0, deadline - time.monotonic())))
+            sampler.sample(stats)
+        await asyncio.gather(*clients)
+
+    async def settle() -> dict:
+        """Let every conversation end: orphan cancels, buffer TTL, idle eviction."""
+        settle_until = time.monotonic() + idle_wait + args.settle
+        while time.monotonic() < settle_until and any(sampler.live().values()):
+            await asyncio.sleep(0.5)
+        await asyncio.sleep(2 * float(os.environ["CLEANUP_INTERVAL_SECONDS"]))
+        return sampler.live()
+
+    # Two halves: one-off growth (caches filling up, tables resizing) lands in
+    # the first; memory still growing in the second is a per-conversation leak.
+    await churn(args.duration / 2)
+    await settle()
+    first_retained, first_started = sampler.retained(), stats["conversations"]
+    sampler.mark()
+    print(f"after first half: retained {first_retained / 1e6:.2f}MB over {first_started} conversations", file=out)
+
+    await churn(args.duration / 2)
+    live = await settle()
+    retained = sampler.retained()
+    accumulated, growth = sampler.growth()
+    started = stats["conversations"] - first_started
+    per_conversation = accumulated / max(1, started)
+    print(f"scenarios: {dict(stats)}", file=out)
+    print(f"left after settling: {live}", file=out)
+    print(f"retained: {retained / 1e6:.2f}MB since the baseline ({(retained - first_retained) / 1e6:.2f}MB "
+          f"in the second half); accumulating over the {started} conversations of the second half: "
+          f"{accumulated / 1e3:.1f}KB = {per_conversation:.0f} bytes each (limit {args.max_retained_bytes}); "
+          f"rss={rss_bytes() / 1e6:.1f}MB", file=out)
+
+    failed = per_conversation > args.max_retained_bytes or started == 0 or any(live.values())
+    if failed or args.verbose:
+        sampler.report_growth(growth)
+
+    server.should_exit = True
+    await server_task
+    print("FAIL" if failed else "PASS", file=out)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=600, help="seconds of churn")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--think-time", type=float, default=0.5, help="max pause between scenarios (s)")
+    parser.add_argument("--sample-interval", type=float, default=30)
+    parser.add_argument("--settle", type=float, default=30, help="extra seconds allowed for conversations to be evicted")
+    parser.add_argument("--max-retained-bytes", type=int, default=256, help="per conversation, after settling")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="keep server logs and always print allocation growth")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    if not args.verbose:
+        # the server logs every message; keep only the soak report
+        sys.stdout = open(os.devnull, "w")
+    tracemalloc.start()
+    sys.exit(asyncio.run(soak(args, out)))
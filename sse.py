@@ -0,0 +1,62 @@
+"""Server-Sent Events transport for clients that cannot use WebSockets.
+
+`SSEConnection` is a `ClientConnection` whose writer emits SSE frames instead
+of WebSocket messages, so the orchestrator, per-conversation channels, credit
+flow control and replay work unchanged. Each frame carries the event's
+`sequence` as its SSE `id`, so a browser `EventSource` resumes natively by
+sending it back as `Last-Event-ID` on reconnect. Event data is the
+envelope's cached JSON, written as-is.
+"""
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+
+from connection import ClientConnection
+from events import Event
+
+# Frames buffered per client before the writer waits for the response to drain
+SSE_CLIENT_QUEUE = int(os.getenv("SSE_CLIENT_QUEUE", "256"))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+# Reconnect delay suggested to EventSource clients
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "2000"))
+
+
+def last_event_id(header: Optional[str], last_sequence: Optional[int]) -> Optional[int]:
+    """Resume point: `Last-Event-ID` (sent by EventSource) wins over the query."""
+    if header:
+        try:
+            return int(header)
+        except ValueError:
+            pass
+    return last_sequence
+
+
+class SSEConnection(ClientConnection):
+    def __init__(self, frame_queue: int = SSE_CLIENT_QUEUE, **kwargs):
+        super().__init__(websocket=None, **kwargs)
+        # None marks the end of the stream
+        self.frames: asyncio.Queue = asyncio.Queue(maxsize=frame_queue)
+
+    async def _write(self, ev: Event | Dict[str, Any]) -> None:
+        if isinstance(ev, Event):
+            await self.frames.put(f"id: {ev.sequence}\nevent: {ev.type}\ndata: {ev.to_json()}\n\n")
+            return
+
+        await self.frames.put(f"event: {ev.get('type', 'status')}\ndata: {json.dumps(ev)}\n\n")
+        if (ev.get("payload") or {}).get("status") in ("lagged", "reconnect"):
+            # end the response; EventSource reconnects with Last-Event-ID and replays
+            await self.frames.put(None)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Frames for the HTTP response body, with keep-alive comments when idle."""
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while not self.closed:
+            try:
+                frame = await asyncio.wait_for(self.frames.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if frame is None:
+                return
+            yield frame
@@ -0,0 +1,72 @@
+"""Startup warm-up for a fresh worker.
+
+Runs once in the background after startup so the first real conversation
+does not pay for imports, prompt compilation, graph compilation, TLS
+handshakes to the model endpoint or Redis connection setup. Each phase is
+timed; failures are recorded and do not stop the remaining phases.
+"""
+import asyncio
+import importlib
+import os
+import time
+from typing import Any, Dict
+
+WARMUP_HTTP_CONNECTIONS = int(os.getenv("WARMUP_HTTP_CONNECTIONS", "4"))
+WARMUP_REDIS_CONNECTIONS = int(os.getenv("WARMUP_REDIS_CONNECTIONS", "4"))
+# Run one conversation through the graph against the local stand-in model
+WARMUP_SYNTHETIC = os.getenv("WARMUP_SYNTHETIC", "0") == "1"
+
+
+async def _synthetic_conversation() -> None:
+    from services.agent import VBChatbot
+
+    vb = VBChatbot(backend="standin")
+    thread_id = "__warmup__"
+    async for _ in vb.run(thread_id=thread_id, message="hello", resume=False, user_info={"user_id": "warmup"}):
+        pass
+    await vb.delete_graph(thread_id)
+
+
+async def warm_up(orch, buffer) -> Dict[str, Any]:
+    """Run all warm-up phases; returns per-phase timings in ms (or the error)."""
+    from services.utils import executors
+    from services.utils.llm import prewarm_http
+    from services.utils.prompt_manager import prompt_registry
+
+    report: Dict[str, Any] = {}
+
+    async def _phase(name: str, fn):
+        started = time.monotonic()
+        try:
+            await fn()
+            report[name] = round((time.monotonic() - started) * 1000, 1)
+        except Exception as e:
+            report[name] = f"failed: {e}"
+
+    def _build_chatbot():
+        from services.agent import VBChatbot
+
+        vb = VBChatbot()
+        vb.compile_graph()
+        return vb
+
+    async def _compile_graph():
+        # model clients and graph are built off the loop; the instance is
+        # installed on the loop, where a conversation may already have made one
+        vb = await asyncio.to_thread(_build_chatbot)
+        orch.install_chatbot(vb).compile_graph()
+
+    # import the heavy LLM stack off the event loop so health checks keep answering
+    await _phase("import_llm_stack", lambda: asyncio.to_thread(importlib.import_module, "services.agent"))
+    await _phase("prompts", lambda: asyncio.to_thread(prompt_registry.warm))
+    await _phase("graph", _compile_graph)
+    await asyncio.gather(
+        _phase("http_pool", lambda: prewarm_http(WARMUP_HTTP_CONNECTIONS)),
+        _phase("redis_pool", lambda: asyncio.to_thread(buffer.warm_up, WARMUP_REDIS_CONNECTIONS)),
+        # start the CPU worker processes before the first large parse needs them
+        _phase("process_pool", lambda: asyncio.to_thread(executors.cpu.warm_up)),
+    )
+    if WARMUP_SYNTHETIC:
+        await _phase("synthetic_conversation", _synthetic_conversation)
+
+    return report